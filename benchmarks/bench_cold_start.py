@@ -0,0 +1,91 @@
+"""
+コールドスタートのベンチマーク
+
+ルートごとに新しいPythonプロセスで `import index` と最初の1リクエストを処理し、
+初期化にかかる時間を測る (-X importtime の結果から、時間のかかったimportも表示する)
+上流への接続は到達しないプロキシに向けて即座に失敗させるので、ネットワークの速さには左右されない
+
+    python benchmarks/bench_cold_start.py [--runs 5] [--report 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(ROOT, '..', 'lambda', 'api_aggregator')
+
+ROUTES = (
+    '/api/news',
+    '/api/weather',
+    '/api/steam',
+    '/api/english/word',
+    '/api/english/quiz',
+    '/api/dashboard',
+)
+
+# 子プロセスで実行するコード: import と最初のリクエストの時間をJSONで出力する
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.handler({'rawPath': sys.argv[1], 'queryStringParameters': {}}, None)
+handled = time.perf_counter()
+sys.stdout.write(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (handled - imported) * 1000,
+}))
+"""
+
+
+def run_once(path, importtime=False):
+    env = dict(os.environ)
+    # 上流へのリクエストは接続拒否ですぐに失敗させる
+    env['HTTP_PROXY'] = env['HTTPS_PROXY'] = 'http://127.0.0.1:9'
+    env['DICTIONARY_CACHE_PATH'] = os.devnull + '.missing'
+    args = [sys.executable]
+    if importtime:
+        args += ['-X', 'importtime']
+    args += ['-c', CHILD, path]
+    proc = subprocess.run(args, cwd=LAMBDA_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def slowest_imports(stderr, count):
+    """
+    -X importtime の出力から、累積時間の長い上位のモジュールを返す
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        head, cumulative_us, name = line.split('|', 2)
+        rows.append((int(cumulative_us), int(head.split(':')[1]), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--report', type=int, default=0, help='ルートごとに表示する遅いimportの数')
+    args = parser.parse_args()
+
+    print(f"{'route':<20}{'import ms':>11}{'first req ms':>14}{'total ms':>10}")
+    for path in ROUTES:
+        samples = [run_once(path)[0] for _ in range(args.runs)]
+        import_ms = statistics.median(s['import_ms'] for s in samples)
+        first_ms = statistics.median(s['first_request_ms'] for s in samples)
+        print(f"{path:<20}{import_ms:>11.1f}{first_ms:>14.1f}{import_ms + first_ms:>10.1f}")
+
+        if args.report:
+            _, stderr = run_once(path, importtime=True)
+            for cumulative_us, self_us, name in slowest_imports(stderr, args.report):
+                print(f"    {cumulative_us / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
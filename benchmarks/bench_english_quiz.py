@@ -0,0 +1,109 @@
+"""
+英単語クイズ生成のベンチマーク
+
+以前の get_quiz (毎回正解以外の単語リストをコピーし、正規表現で例文を隠す) と、
+english.Vocabulary の前計算を使う get_quiz の1問あたりの時間を、
+語彙数を増やしながら比較する (語彙は business_words.json を水増しして作る)
+
+    python benchmarks/bench_english_quiz.py [--quizzes 2000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+import english  # noqa: E402
+
+SIZES = (702, 5000, 20000, 50000)
+
+
+def legacy_quiz(words):
+    """
+    変更前の english.get_quiz (単語リストを引数にしたもの)
+    """
+    correct = random.choice(words)
+    others = random.sample([w for w in words if w['word'] != correct['word']], 3)
+    options = others + [correct]
+    random.shuffle(options)
+    example_hint = ""
+    if correct.get('example'):
+        word_esc = re.escape(correct['word'])
+        example_hint = re.sub(word_esc, '_______', correct['example'], flags=re.IGNORECASE)
+    return {
+        "question": f"What is the meaning of '{correct['word']}'?",
+        "correct_word": correct['word'],
+        "example": example_hint,
+        "options": [
+            {"label": w['meaning_ja'], "word": w['word'], "is_correct": (w['word'] == correct['word'])}
+            for w in options
+        ]
+    }
+
+
+def make_words(base, size):
+    """
+    base の単語に連番を付けて size 語に増やす
+    """
+    words = []
+    for i in range(size):
+        entry = base[i % len(base)]
+        if i < len(base):
+            words.append(entry)
+            continue
+        word = f"{entry['word']}{i}"
+        words.append({
+            'word': word,
+            'meaning_ja': entry['meaning_ja'],
+            'example': entry['example'].replace(entry['word'], word)
+        })
+    return words
+
+
+def per_quiz_us(func, quizzes):
+    started = time.perf_counter()
+    func(quizzes)
+    return (time.perf_counter() - started) / quizzes * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--quizzes', type=int, default=2000)
+    args = parser.parse_args()
+
+    base = english.load_words()
+    print(f"{'words':>7}{'build ms':>10}{'legacy us':>11}{'new us':>9}{'batch us':>10}")
+    for size in SIZES:
+        words = make_words(base, size)
+
+        started = time.perf_counter()
+        english._vocabulary = english.Vocabulary(words)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        def run_legacy(n):
+            for _ in range(n):
+                legacy_quiz(words)
+
+        def run_new(n):
+            for _ in range(n):
+                english.get_quiz()
+
+        def run_batch(n):
+            for _ in range(n // english.MAX_QUIZ_COUNT):
+                english.get_quiz(count=english.MAX_QUIZ_COUNT)
+
+        # 以前の実装は語彙数に比例して遅くなるので、大きい語彙では問題数を減らす
+        legacy_quizzes = max(args.quizzes * len(base) // size, 50)
+        legacy = per_quiz_us(run_legacy, legacy_quizzes)
+        new = per_quiz_us(run_new, args.quizzes)
+        batch_quizzes = max(args.quizzes // english.MAX_QUIZ_COUNT, 1) * english.MAX_QUIZ_COUNT
+        batch = per_quiz_us(run_batch, batch_quizzes)
+        print(f"{size:>7}{build_ms:>10.1f}{legacy:>11.1f}{new:>9.1f}{batch:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+フィードパーサーのベンチマーク
+
+feedparser経由のパース (news._parse_entries) と fastfeed のパースを、
+fixtures/feeds/ のフィードで比較する (CPU時間とピークメモリ)
+
+    python benchmarks/bench_parse_feed.py [--iterations 50]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+import feedparser  # noqa: E402
+
+import fastfeed  # noqa: E402
+import news  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, 'fixtures', 'feeds')
+
+
+def parse_with_feedparser(data):
+    return news._parse_entries(feedparser.parse(data))
+
+
+def parse_with_fastfeed(data):
+    _, entries = fastfeed.parse(data)
+    for entry in entries:
+        entry['summary'] = news.clean_summary(entry['summary'])
+    return entries
+
+
+PARSERS = {
+    'feedparser': parse_with_feedparser,
+    'fastfeed': parse_with_fastfeed,
+}
+
+
+def measure(func, data, iterations):
+    # CPU時間
+    started = time.process_time()
+    for _ in range(iterations):
+        func(data)
+    cpu_ms = (time.process_time() - started) * 1000 / iterations
+
+    # ピークメモリ (1回分)
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_ms, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'fixture':<12}{'parser':<12}{'entries':>8}{'cpu ms/parse':>14}{'peak KiB':>10}")
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            data = f.read()
+        for label, func in PARSERS.items():
+            entries = func(data)
+            cpu_ms, peak = measure(func, data, args.iterations)
+            print(f"{name:<12}{label:<12}{len(entries):>8}{cpu_ms:>14.2f}{peak / 1024:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+全ルートのベンチマーク
+
+stub_upstream.py のスタブサーバーに上流へのリクエストを向けて、
+index.handler をルートごとに呼び出し、次の値を測る
+  cold   : キャッシュを空にした状態からの1リクエスト (上流の取得・パース・整形・JSON化すべて)
+  warm   : キャッシュが効いている状態での1リクエスト (並べ替え・絞り込み・JSON化)
+  rps    : warm の状態で --concurrency 並列で呼び出したときのスループット
+  peak   : cold の1リクエストで確保したメモリのピーク (tracemalloc)
+  blocks : cold の1リクエストの後に残ったメモリブロック数 (tracemalloc)
+  rss    : そのルートまで実行した時点のプロセスの最大RSS
+parse / serialize は cold の中のフィード・予報のパースと、JSON化・圧縮の時間 (metrics の集計)
+
+    python benchmarks/bench_routes.py [--cold 10] [--warm 100] [--concurrency 8]
+    python benchmarks/bench_routes.py --save       # 結果を baseline.json に保存する
+    python benchmarks/bench_routes.py --check      # baseline.json より遅くなったルートがあれば終了コード 1
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+from stub_upstream import StubUpstream  # noqa: E402
+
+BASELINE = os.path.join(ROOT, 'baseline.json')
+
+# (名前, パス, クエリパラメータ)
+ROUTES = (
+    ('news', '/api/news', {}),
+    ('news_category', '/api/news', {'category': 'tech'}),
+    ('news_page', '/api/news', {'limit': '20'}),
+    ('news_search', '/api/news/search', {'q': 'セール'}),
+    ('weather', '/api/weather', {'lat': '35.6895', 'lon': '139.6917'}),
+    ('steam', '/api/steam', {}),
+    ('steam_sales', '/api/steam/sales', {}),
+    ('english_word', '/api/english/word', {}),
+    ('english_quiz', '/api/english/quiz', {'count': '10'}),
+    ('dashboard', '/api/dashboard', {}),
+)
+
+# --check で比べる値と、許容する悪化の割合・絶対値 (測定のぶれで失敗しないように)
+CHECKED = ('cold_p50_ms', 'warm_p50_ms', 'peak_kib')
+MIN_SLACK = {'cold_p50_ms': 2.0, 'warm_p50_ms': 0.5, 'peak_kib': 64}
+
+
+def setup(base_url):
+    """
+    スタブサーバーに向けた状態で Lambda のモジュールを読み込む
+    (上流の書き換え先などは import 時に読まれるので、先に環境変数を設定する)
+    """
+    os.environ['UPSTREAM_REWRITE_BASE'] = base_url
+    os.environ['METRICS_ENABLED'] = '0'
+    # スタブは1ms程度で応答するので、適応タイムアウトが下限まで縮み、
+    # パース中のスレッドとCPUを取り合ったときに誤ってタイムアウトしないようにする
+    os.environ.setdefault('UPSTREAM_TIMEOUT_MIN', '5')
+    os.environ.pop('SNAPSHOT_STORE', None)
+    workdir = tempfile.mkdtemp()
+    os.environ['DICTIONARY_CACHE_PATH'] = os.path.join(workdir, 'dictionary_cache.json')
+    os.environ['ARTICLE_DB_PATH'] = os.path.join(workdir, 'articles.sqlite3')
+
+    import index
+    return index
+
+
+def reset_caches():
+    """
+    上流から取得し直すように、各モジュールのキャッシュを空にする
+    """
+    import dictionary
+    import news
+    import steam
+    import weather
+
+    news._feed_cache.clear()
+    weather._weather_cache.clear()
+    steam._steam_cache.clear()
+    dictionary._cache.clear()
+    dictionary._records = None
+    if os.path.exists(dictionary.DICTIONARY_CACHE_PATH):
+        os.remove(dictionary.DICTIONARY_CACHE_PATH)
+
+
+def call(index, path, params):
+    import metrics
+
+    event = {'rawPath': path, 'queryStringParameters': dict(params), 'headers': {'accept-encoding': 'gzip'}}
+    started = time.perf_counter()
+    response = index.handler(event, None)
+    elapsed = (time.perf_counter() - started) * 1000
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"{path} returned {response['statusCode']}: {response['body'][:200]}")
+    return elapsed, metrics.current()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def measure(index, path, params, args):
+    cold = []
+    parse = []
+    serialize = []
+    for _ in range(args.cold):
+        reset_caches()
+        elapsed, request_metrics = call(index, path, params)
+        cold.append(elapsed)
+        parse.append(request_metrics.timings.get('parse', 0.0))
+        serialize.append(request_metrics.timings.get('serialize', 0.0))
+
+    warm = [call(index, path, params)[0] for _ in range(args.warm)]
+
+    # 並列で呼び出したときのスループット
+    requests = args.warm * 2
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda _: call(index, path, params), range(requests)))
+    rps = requests / (time.perf_counter() - started)
+
+    # メモリ (cold の1リクエスト)
+    reset_caches()
+    tracemalloc.start()
+    call(index, path, params)
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    return {
+        'cold_p50_ms': round(statistics.median(cold), 2),
+        'cold_p95_ms': round(percentile(cold, 95), 2),
+        'warm_p50_ms': round(statistics.median(warm), 3),
+        'warm_p95_ms': round(percentile(warm, 95), 3),
+        'rps': round(rps, 1),
+        'parse_p50_ms': round(statistics.median(parse), 2),
+        'serialize_p50_ms': round(statistics.median(serialize), 3),
+        'peak_kib': round(peak / 1024, 1),
+        'blocks': blocks,
+        'rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def check(results, baseline, tolerance):
+    """
+    ベースラインより tolerance 倍 (かつ MIN_SLACK) 以上悪化した値を返す
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('routes', {}).get(name)
+        if base is None:
+            continue
+        for key in CHECKED:
+            limit = max(base[key] * tolerance, base[key] + MIN_SLACK[key])
+            if result[key] > limit:
+                regressions.append(f"{name}.{key}: {result[key]} > {limit:.2f} (baseline {base[key]})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cold', type=int, default=10)
+    parser.add_argument('--warm', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', help='対象のルート名 (カンマ区切り)')
+    parser.add_argument('--save', action='store_true', help='結果を baseline.json に保存する')
+    parser.add_argument('--check', action='store_true', help='baseline.json と比べて悪化していれば失敗する')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='--check で許容する倍率')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    args = parser.parse_args()
+
+    stub = StubUpstream().start()
+    index = setup(stub.base_url)
+
+    routes = ROUTES
+    if args.routes:
+        names = set(args.routes.split(','))
+        routes = [route for route in ROUTES if route[0] in names]
+
+    # 初回の import や接続の確立を測定に含めないよう、一通り呼んでおく
+    for _, path, params in routes:
+        call(index, path, params)
+
+    results = {}
+    if not args.json:
+        print(f"{'route':<15}{'cold p50':>9}{'p95':>8}{'warm p50':>10}{'p95':>8}{'rps':>8}"
+              f"{'parse':>8}{'serial':>8}{'peak KiB':>10}{'blocks':>8}{'rss MiB':>9}")
+    for name, path, params in routes:
+        result = results[name] = measure(index, path, params, args)
+        if not args.json:
+            print(f"{name:<15}{result['cold_p50_ms']:>9.1f}{result['cold_p95_ms']:>8.1f}"
+                  f"{result['warm_p50_ms']:>10.2f}{result['warm_p95_ms']:>8.2f}{result['rps']:>8.0f}"
+                  f"{result['parse_p50_ms']:>8.1f}{result['serialize_p50_ms']:>8.2f}"
+                  f"{result['peak_kib']:>10.0f}{result['blocks']:>8}{result['rss_mib']:>9.1f}")
+    stub.stop()
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'routes': results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.save:
+        with open(BASELINE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"Saved baseline to {BASELINE}", file=sys.stderr)
+
+    if args.check:
+        with open(BASELINE, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = check(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
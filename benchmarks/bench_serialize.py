@@ -0,0 +1,156 @@
+"""
+記事の保持とJSON化のベンチマーク
+
+全カテゴリの検索結果のような大きな記事の一覧について、次の2つを比べる
+  dict   : 記事ごとの dict を json.dumps で1つの文字列にしてから圧縮する (以前の組み立て方。encode_dict)
+  compact: compact.Entry を jsonstream でチャンクごとにエンコード・圧縮する (responses.build_json)
+記事はスナップショット・記事ストアから読んだときと同じく、配信元名などの文字列が記事ごとに別のオブジェクトになっている
+
+  held     : 記事の一覧を保持するのに使っているメモリ (tracemalloc)
+  encode   : レスポンスを組み立てる時間 (JSON化・ETag・圧縮・base64)
+  peak     : レスポンスを組み立てる間に追加で確保したメモリのピーク (tracemalloc)
+
+    python benchmarks/bench_serialize.py [--sizes 1000,10000,100000] [--repeat 3] [--encoding gzip]
+"""
+import argparse
+import base64
+import gc
+import gzip
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+import compact  # noqa: E402
+import jsonstream  # noqa: E402
+import responses  # noqa: E402
+
+SOURCES = ('ITmedia NEWS', 'Publickey', 'CNET Japan', 'GIGAZINE', 'INTERNET Watch', '4Gamer.net', 'ファミ通.com',
+           'AUTOMATON', 'Game*Spark', 'アニメイトタイムズ', 'コミックナタリー', 'ナタリー', '映画.com',
+           'Yahoo!ニュース・トピックス - 主要')
+WORDS = ('クラウド', 'セール', '発表', '新作', 'アップデート', 'スマートフォン', '配信', '開始', '決定', '公開',
+         'ゲーム', 'アニメ', '映画', 'AI', 'サービス', '対応', '発売', '記念', 'イベント', '開催')
+
+
+def make_entries(count, seed=0):
+    """
+    count 件の記事の dict を作る (JSONを経由して、文字列を記事ごとに別のオブジェクトにする)
+    """
+    rng = random.Random(seed)
+    now = 1750000000
+    entries = []
+    for i in range(count):
+        source = rng.choice(SOURCES)
+        timestamp = int(now - i * 60)
+        entries.append({
+            'title': ''.join(rng.choice(WORDS) for _ in range(6)),
+            'link': f"https://news.example.jp/articles/{i:07d}",
+            'published': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+            'timestamp': timestamp,
+            'summary': ''.join(rng.choice(WORDS) for _ in range(40))[:200],
+            'source': source,
+            'image': f"https://img.example.jp/{i:07d}.jpg" if i % 3 else None,
+        })
+    return json.loads(json.dumps(entries, ensure_ascii=False))
+
+
+def held_bytes(build):
+    """
+    build() が返した値を保持するのに使っているメモリ
+    """
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, held
+
+
+def encode_dict(entries, request_headers):
+    """
+    以前の responses.build と同じ組み立て方
+    JSONの文字列全体を作り、そのUTF-8のバイト列からハッシュを計算して一度に圧縮する
+    """
+    body_text = json.dumps(entries, ensure_ascii=False)
+    body = body_text.encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    encoding = responses.negotiate_encoding(request_headers.get('accept-encoding'))
+    if len(body) < responses.COMPRESS_MIN_SIZE:
+        encoding = None
+
+    headers = {'ETag': responses.make_etag(digest, encoding), 'Vary': 'Accept-Encoding'}
+    if encoding is None:
+        return {'statusCode': 200, 'headers': headers, 'body': body_text}
+
+    headers['Content-Encoding'] = encoding
+    if encoding == 'br':
+        compressed = responses.brotli.compress(body, quality=5)
+    else:
+        compressed = gzip.compress(body, compresslevel=6, mtime=0)
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def encode_compact(entries, request_headers):
+    return responses.build_json(200, {}, entries, request_headers)
+
+
+def measure(encode, entries, request_headers, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = encode(entries, request_headers)
+        times.append((time.perf_counter() - started) * 1000)
+        del response
+
+    gc.collect()
+    tracemalloc.start()
+    response = encode(entries, request_headers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--encoding', default='gzip', help='Accept-Encoding (none で無圧縮)')
+    args = parser.parse_args()
+
+    request_headers = {} if args.encoding == 'none' else {'accept-encoding': args.encoding}
+
+    print(f"{'entries':>8}  {'path':<8}{'held MiB':>10}{'encode ms':>11}{'peak MiB':>10}{'body KiB':>10}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        dicts, dict_held = held_bytes(lambda: make_entries(size))
+        entries, compact_held = held_bytes(lambda: compact.compact(make_entries(size)))
+
+        results = {}
+        for label, encode, data, held in (('dict', encode_dict, dicts, dict_held),
+                                          ('compact', encode_compact, entries, compact_held)):
+            encode_ms, peak, response = measure(encode, data, request_headers, args.repeat)
+            results[label] = response
+            print(f"{size:>8}  {label:<8}{held / 2**20:>10.1f}{encode_ms:>11.1f}{peak / 2**20:>10.1f}"
+                  f"{len(response['body']) / 1024:>10.0f}")
+
+        # 同じ内容のレスポンスになっているか (ETag は無圧縮のボディから計算する)
+        if results['dict']['headers']['ETag'] != results['compact']['headers']['ETag']:
+            raise RuntimeError(f"Responses differ for {size} entries")
+        assert jsonstream.dumps(entries[:10]) == json.dumps(dicts[:10], ensure_ascii=False)
+        del dicts, entries, results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+天気予報の整形処理のベンチマーク
+
+以前のインデックスループによる整形 (legacy) と、weather._build_forecast /
+weather._build_pollen の列単位の整形を、数日分の hourly データで比較する
+
+    python benchmarks/bench_weather_reshape.py [--iterations 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+import weather  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, 'fixtures', 'open-meteo')
+
+
+def legacy_forecast(data, hours):
+    """
+    変更前の weather.get_weather の整形処理 (hourly の件数だけ引数にしたもの)
+    """
+    result = {}
+    result["current"] = data.get("current_weather", {})
+    result["daily"] = []
+    daily = data.get("daily", {})
+    if daily:
+        times = daily.get("time", [])
+        max_temps = daily.get("temperature_2m_max", [])
+        min_temps = daily.get("temperature_2m_min", [])
+        precip_probs = daily.get("precipitation_probability_max", [])
+        weather_codes = daily.get("weathercode", [])
+        for i in range(len(times)):
+            result["daily"].append({
+                "date": times[i],
+                "max_temp": max_temps[i] if i < len(max_temps) else None,
+                "min_temp": min_temps[i] if i < len(min_temps) else None,
+                "precip_prob": precip_probs[i] if i < len(precip_probs) else None,
+                "weather_code": weather_codes[i] if i < len(weather_codes) else None
+            })
+    result["hourly"] = []
+    hourly = data.get("hourly", {})
+    if hourly:
+        times = hourly.get("time", [])
+        temps = hourly.get("temperature_2m", [])
+        probs = hourly.get("precipitation_probability", [])
+        amounts = hourly.get("precipitation", [])
+        count = min(len(times), hours)
+        for i in range(count):
+            result["hourly"].append({
+                "time": times[i],
+                "temp": temps[i] if i < len(temps) else None,
+                "precip_prob": probs[i] if i < len(probs) else None,
+                "precip_amount": amounts[i] if i < len(amounts) else None
+            })
+    return result
+
+
+def legacy_pollen(p_data):
+    pollen = {}
+    hourly_pollen = p_data.get("hourly", {})
+    if hourly_pollen:
+        for p_type in weather.POLLEN_TYPES:
+            values = hourly_pollen.get(p_type, [])
+            today_values = values[:24] if values else []
+            valid_values = [v for v in today_values if v is not None]
+            pollen[p_type] = max(valid_values) if valid_values else 0
+    return pollen
+
+
+def extend(block, key, days, step):
+    """
+    fixture の配列を days 日分に伸ばす
+    """
+    start = datetime.fromisoformat(block[key][0])
+    per_day = 24 if step == timedelta(hours=1) else 1
+    length = days * per_day
+    out = {key: [(start + step * i).strftime('%Y-%m-%dT%H:%M' if per_day == 24 else '%Y-%m-%d')
+                 for i in range(length)]}
+    for name, values in block.items():
+        if name != key:
+            out[name] = [values[i % len(values)] for i in range(length)]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(os.path.join(FIXTURES, 'forecast.json'), encoding='utf-8') as f:
+        forecast = json.load(f)
+    with open(os.path.join(FIXTURES, 'air_quality.json'), encoding='utf-8') as f:
+        air_quality = json.load(f)
+
+    # 先頭から整形させるため、現在時刻をデータの開始時刻に固定する
+    now = datetime.fromisoformat(forecast['hourly']['time'][0]).replace(tzinfo=weather.JST)
+
+    print(f"{'days':>5}{'rows':>6}{'legacy us':>12}{'rows us':>10}{'columnar us':>13}{'pollen legacy/new us':>22}")
+    # (取得日数, 返す hourly の行数): 既定の24時間分と、全期間を行に展開する場合
+    for days, rows in ((1, 24), (7, 24), (7, 168), (16, 24), (16, 384)):
+        data = dict(forecast)
+        data['hourly'] = extend(forecast['hourly'], 'time', days, timedelta(hours=1))
+        data['daily'] = extend(forecast['daily'], 'time', days, timedelta(days=1))
+        p_data = {'hourly': extend(air_quality['hourly'], 'time', days, timedelta(hours=1))}
+
+        assert legacy_forecast(data, rows)['hourly'] == weather._build_forecast(data, hours=rows, now=now)['hourly']
+        assert legacy_pollen(p_data) == weather._build_pollen(p_data)
+
+        def per_call(stmt):
+            return timeit.timeit(stmt, number=args.iterations) / args.iterations * 1e6
+
+        legacy = per_call(lambda: legacy_forecast(data, rows))
+        new_rows = per_call(lambda: weather._build_forecast(data, hours=rows, now=now))
+        new_columnar = per_call(lambda: weather._build_forecast(data, hours=rows, now=now, columnar=True))
+        pollen_legacy = per_call(lambda: legacy_pollen(p_data))
+        pollen_new = per_call(lambda: weather._build_pollen(p_data))
+        print(f"{days:>5}{rows:>6}{legacy:>12.1f}{new_rows:>10.1f}{new_columnar:>13.1f}"
+              f"{pollen_legacy:>12.1f} / {pollen_new:<7.1f}")
+
+
+if __name__ == '__main__':
+    main()
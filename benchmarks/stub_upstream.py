@@ -0,0 +1,207 @@
+"""
+上流API (RSS・Steam・Open-Meteo・Free Dictionary) のスタブサーバー
+
+upstream.UPSTREAM_REWRITE_BASE にこのサーバーのURLを指定すると、
+https://host/path へのリクエストが http://127.0.0.1:PORT/host/path に届く
+
+レスポンスは次の順に探す
+  1. fixtures/upstream/<host><path>  (--record で保存した実際のレスポンス)
+  2. fixtures/ の合成データ (フィード・天気・Steam・辞書の形式ごとに用意したもの)
+
+    python benchmarks/stub_upstream.py [--port 8780] [--record]
+
+--record を付けると 1. にないリクエストを実際の上流から取得して保存する (ネットワークが必要)
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import urllib.request
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(ROOT, 'fixtures')
+RECORDED = os.path.join(FIXTURES, 'upstream')
+
+JST = timezone(timedelta(hours=9))
+
+# 合成フィードの中のホスト名 (リクエストされたフィードのホストに置き換える)
+FEED_FIXTURE_HOSTS = (b'news.example.jp', b'blog.example.jp', b'www.example.co.jp')
+
+
+def _read(*path):
+    with open(os.path.join(FIXTURES, *path), 'rb') as f:
+        return f.read()
+
+
+class Fixtures:
+    """
+    リクエストのホスト・パスから返すデータを決める
+    """
+
+    def __init__(self, record=False):
+        self.record = record
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, host, path, query):
+        """
+        (ステータスコード, Content-Type, ボディ) を返す
+        """
+        recorded = os.path.join(RECORDED, host, path.lstrip('/') or 'index')
+        if os.path.isfile(recorded):
+            with open(recorded, 'rb') as f:
+                return 200, _content_type(recorded), f.read()
+        if self.record:
+            return self._record(host, path, query, recorded)
+        return self._synthetic(host, path)
+
+    def _synthetic(self, host, path):
+        if host == 'api.open-meteo.com':
+            return 200, 'application/json', self._open_meteo('forecast.json')
+        if host == 'air-quality-api.open-meteo.com':
+            return 200, 'application/json', self._open_meteo('air_quality.json')
+        if host == 'store.steampowered.com':
+            return 200, 'application/json', self._fixture('steam', 'featuredcategories.json')
+        if host == 'api.dictionaryapi.dev':
+            word = unquote(path.rsplit('/', 1)[-1])
+            body = self._fixture('dictionary', 'entry.json')
+            return 200, 'application/json', body.replace(b'{word}', json.dumps(word)[1:-1].encode('utf-8'))
+
+        # それ以外はRSSフィードとして扱う (URLから形式を推測する)
+        if path.endswith('.rdf') or '/1.0/' in path:
+            name = 'rdf.xml'
+        elif 'atom' in path:
+            name = 'atom.xml'
+        else:
+            name = 'rss2.xml'
+        body = self._fixture('feeds', name)
+        # フィードごとに記事のURLが別になるよう、ホスト名を差し替える
+        for fixture_host in FEED_FIXTURE_HOSTS:
+            body = body.replace(fixture_host, host.encode('ascii'))
+        return 200, 'application/xml', body
+
+    def _open_meteo(self, name):
+        """
+        予報は現在時刻から切り出されるので、fixture の日付を今日 (JST) からに移す
+        """
+        today = datetime.now(JST).date()
+        key = ('open-meteo', name, today)
+        with self._lock:
+            body = self._cache.get(key)
+        if body is None:
+            data = json.loads(self._fixture('open-meteo', name))
+            for block in ('hourly', 'daily'):
+                if block in data:
+                    data[block]['time'] = _shift_days(data[block]['time'], today)
+            body = json.dumps(data).encode('utf-8')
+            with self._lock:
+                self._cache[key] = body
+        return body
+
+    def _fixture(self, *path):
+        with self._lock:
+            data = self._cache.get(path)
+            if data is None:
+                data = self._cache[path] = _read(*path)
+            return data
+
+    def _record(self, host, path, query, recorded):
+        url = f"https://{host}{path}" + (f"?{query}" if query else '')
+        request = urllib.request.Request(url, headers={'User-Agent': 'news-hub/1.0'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            body = response.read()
+            content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        os.makedirs(os.path.dirname(recorded), exist_ok=True)
+        with open(recorded, 'wb') as f:
+            f.write(body)
+        return 200, content_type, body
+
+
+def _shift_days(times, today):
+    first = date.fromisoformat(times[0][:10])
+    offset = today - first
+    return [(date.fromisoformat(t[:10]) + offset).isoformat() + t[10:] for t in times]
+
+
+def _content_type(path):
+    if path.endswith('.json') or '/api/' in path or '/v1/' in path:
+        return 'application/json'
+    return 'application/xml'
+
+
+def make_handler(fixtures):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # ヘッダーとボディを別々に送るので、Nagle と遅延ACKで 40ms 待たされないようにする
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            host, _, path = parts.path.lstrip('/').partition('/')
+            try:
+                status, content_type, body = fixtures.lookup(host, '/' + path, parts.query)
+            except Exception as e:
+                status, content_type, body = 502, 'text/plain', str(e).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # クライアント側のタイムアウトで切断されたものは無視する
+        pass
+
+
+class StubUpstream:
+    """
+    バックグラウンドのスレッドでスタブサーバーを動かす
+    port=0 の場合は空いているポートを使う
+    """
+
+    def __init__(self, port=0, record=False):
+        self.server = _Server(('127.0.0.1', port), make_handler(Fixtures(record=record)))
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--record', action='store_true')
+    args = parser.parse_args()
+
+    stub = StubUpstream(port=args.port, record=args.record)
+    print(f"Serving upstream fixtures on {stub.base_url} (UPSTREAM_REWRITE_BASE={stub.base_url})", file=sys.stderr)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -114,6 +114,33 @@ async function fetchWithTimeout(resource, options = {}) {
 }
 
 export const api = {
+    // 初回表示に必要なデータ (ニュース・天気・Steam・英単語・クイズ) を1回のリクエストで取得
+    // 失敗したセクションは errors に入り、sections には含まれない
+    async getDashboard(location, category = 'top') {
+        if (USE_MOCK) {
+            await new Promise(r => setTimeout(r, 500));
+            return {
+                sections: {
+                    news: MOCK_DATA.news,
+                    weather: MOCK_DATA.weather,
+                    steam: MOCK_DATA.steam,
+                    word: MOCK_DATA.english.word,
+                    quiz: MOCK_DATA.english.quiz
+                },
+                errors: {}
+            };
+        }
+
+        const params = new URLSearchParams();
+        if (category) params.append('category', category);
+        if (location) {
+            params.append('lat', location.lat);
+            params.append('lon', location.lon);
+        }
+        const res = await fetchWithTimeout(`${API_BASE_URL}/dashboard?${params.toString()}`, { timeout: 10000 });
+        return res.json();
+    },
+
     async getNews(category = 'top', keyword = null) {
         if (USE_MOCK) {
             await new Promise(r => setTimeout(r, 500)); // Simulate delay
@@ -139,6 +166,12 @@ export const api = {
         return res.json();
     },
 
+    async getSteam() {
+        if (USE_MOCK) return MOCK_DATA.steam;
+        const res = await fetchWithTimeout(`${API_BASE_URL}/steam`);
+        return res.json();
+    },
+
     async getSteamSales() {
         if (USE_MOCK) return MOCK_DATA.steam.sales;
         const res = await fetchWithTimeout(`${API_BASE_URL}/steam/sales`);
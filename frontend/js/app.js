@@ -12,12 +12,26 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // Initialize Components
     initTheme();
-    initWeather(userSettings.location);
-    initNews(userSettings.categories);
-    initSteam();
-    initEnglish();
     initSettingsModal();
 
+    // 初回表示のデータは /dashboard でまとめて取得し、
+    // 取得できなかったセクションだけ各コンポーネントが個別に取得する
+    let sections = {};
+    try {
+        const dashboard = await api.getDashboard(userSettings.location, currentCategory);
+        sections = dashboard.sections || {};
+        if (dashboard.errors && Object.keys(dashboard.errors).length > 0) {
+            console.warn("Dashboard partial failure", dashboard.errors);
+        }
+    } catch (e) {
+        console.error("Dashboard load error", e);
+    }
+
+    initWeather(userSettings.location, sections.weather);
+    initNews(userSettings.categories, sections.news);
+    initSteam(sections.steam);
+    initEnglish(sections.word, sections.quiz);
+
     // Global Event Listeners
     document.getElementById('refresh-btn').addEventListener('click', () => {
         location.reload();
@@ -54,7 +68,7 @@ function applyTheme(theme) {
 // --- News Logic ---
 let currentCategory = 'top';
 
-async function initNews(categories) {
+async function initNews(categories, initialNews) {
     // Setup Tabs
     const tabContainer = document.querySelector('.overflow-x-auto');
     // Hide tabs not in user settings? For now, show all but highlight active
@@ -76,7 +90,11 @@ async function initNews(categories) {
     });
 
     // Load initial news
-    loadNews('top');
+    if (initialNews) {
+        renderNews(initialNews);
+    } else {
+        loadNews('top');
+    }
 
     // Search
     const handleSearch = async (query) => {
@@ -175,16 +193,13 @@ function renderError(elementId, message) {
 }
 
 // --- Steam Logic ---
-async function initSteam() {
+async function initSteam(initialInfo) {
     try {
-        const [sales, newReleases, popular] = await Promise.all([
-            api.getSteamSales(),
-            api.getSteamNew(),
-            api.getSteamPopular()
-        ]);
-
-        initSteamCarousel(sales);
-        renderSteamLists(newReleases, popular);
+        // セール・新作・人気を1回のリクエストでまとめて取得
+        const info = initialInfo || await api.getSteam();
+
+        initSteamCarousel(info.sales || []);
+        renderSteamLists(info.new_releases || [], info.top_sellers || []);
     } catch (e) {
         console.error("Steam load error", e);
     }
@@ -1,9 +1,17 @@
 // english.js
 import { api } from './api.js';
 
-export async function initEnglish() {
-    loadWord();
-    loadQuiz();
+export async function initEnglish(initialWord, initialQuiz) {
+    if (initialWord) {
+        renderWord(initialWord);
+    } else {
+        loadWord();
+    }
+    if (initialQuiz) {
+        renderQuiz(initialQuiz);
+    } else {
+        loadQuiz();
+    }
 
     document.getElementById('next-word-btn').addEventListener('click', loadWord);
     document.getElementById('next-quiz-btn').addEventListener('click', loadQuiz);
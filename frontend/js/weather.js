@@ -3,13 +3,13 @@ import { api } from './api.js';
 
 let weatherChart = null;
 
-export async function initWeather(location) {
+export async function initWeather(location, initialData) {
     if (!location) return;
 
     document.getElementById('weather-location').textContent = location.name || "Loading...";
 
     try {
-        const data = await api.getWeather(location.lat, location.lon);
+        const data = initialData || await api.getWeather(location.lat, location.lon);
         renderWeather(data);
     } catch (e) {
         console.error("Weather load failed", e);
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+import time
+
+# 取得した記事を蓄積するストア (SQLite)
+# フィードから消えた記事も残るので、since= で「前回以降の新着」だけを返したり、
+# 過去の記事を引いたりできる。記事は削除しない (同じリンクは最新の内容で上書きする)
+# 同じ記事が複数のカテゴリのフィードに載ることがあるので、カテゴリは (リンク, カテゴリ) の別の表に持つ
+#
+# 保存先は既定で /tmp なので、蓄積されるのはそのコンテナ (server.py ならそのマシン) が読んだ記事だけ
+# Lambda ではコールドスタートで空になり、コンテナ間でも共有されない
+# (since= で返せるのは、そのコンテナが起動してから見た記事まで。足りない分は今のフィードから返す)
+# 取り込み処理 (ingest.py) は API と別のコンテナで動くので、記事ストアには書かない
+
+# 保存先。空にすると蓄積しない
+ARTICLE_DB_PATH = os.environ.get('ARTICLE_DB_PATH', '/tmp/articles.sqlite3')
+
+# since= で一度に返す最大件数
+MAX_SINCE_RESULTS = int(os.environ.get('ARTICLE_MAX_SINCE_RESULTS', '500'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    link       TEXT PRIMARY KEY,
+    title      TEXT,
+    summary    TEXT,
+    image      TEXT,
+    source     TEXT,
+    published  TEXT,
+    timestamp  REAL NOT NULL DEFAULT 0,
+    first_seen REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS articles_timestamp ON articles (timestamp DESC, link DESC);
+CREATE INDEX IF NOT EXISTS articles_source ON articles (source, timestamp DESC);
+CREATE TABLE IF NOT EXISTS article_categories (
+    link     TEXT NOT NULL,
+    category TEXT NOT NULL,
+    PRIMARY KEY (link, category)
+) WITHOUT ROWID;
+"""
+
+UPSERT = """
+INSERT INTO articles (link, title, summary, image, source, published, timestamp, first_seen, updated_at)
+VALUES (:link, :title, :summary, :image, :source, :published, :timestamp, :now, :now)
+ON CONFLICT (link) DO UPDATE SET
+    title = excluded.title,
+    summary = excluded.summary,
+    image = excluded.image,
+    source = excluded.source,
+    published = excluded.published,
+    timestamp = excluded.timestamp,
+    updated_at = excluded.updated_at
+"""
+
+ADD_CATEGORY = "INSERT OR IGNORE INTO article_categories (link, category) VALUES (:link, :category)"
+
+# 記事として返す列 (news の記事と同じキー)
+COLUMNS = ('title', 'link', 'published', 'timestamp', 'summary', 'source', 'image')
+
+_connection = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return bool(ARTICLE_DB_PATH)
+
+
+def _connect():
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(os.path.abspath(ARTICLE_DB_PATH)), exist_ok=True)
+        connection = sqlite3.connect(ARTICLE_DB_PATH, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        _connection = connection
+    return _connection
+
+
+def upsert(entries, category=None):
+    """
+    記事を追加・更新する (リンクが同じものは上書きし、category はそれまでのカテゴリに追加する)
+    """
+    if not enabled() or not entries:
+        return
+    now = time.time()
+    rows = [
+        {
+            'link': entry['link'],
+            'title': entry.get('title'),
+            'summary': entry.get('summary'),
+            'image': entry.get('image'),
+            'source': entry.get('source'),
+            'category': category,
+            'published': entry.get('published'),
+            'timestamp': float(entry.get('timestamp') or 0),
+            'now': now,
+        }
+        for entry in entries if entry.get('link')
+    ]
+    with _lock:
+        connection = _connect()
+        with connection:
+            connection.executemany(UPSERT, rows)
+            if category:
+                connection.executemany(ADD_CATEGORY, rows)
+
+
+def since(timestamp, category=None, limit=None):
+    """
+    timestamp より新しい記事を新しい順に返す
+    """
+    limit = min(int(limit or MAX_SINCE_RESULTS), MAX_SINCE_RESULTS)
+    query = f"SELECT {', '.join(COLUMNS)} FROM articles WHERE timestamp > ?"
+    params = [timestamp]
+    if category:
+        # 新しい順に索引をたどり、カテゴリに含まれる記事だけを返す (LIMIT 件で止まる)
+        query += " AND EXISTS (SELECT 1 FROM article_categories WHERE link = articles.link AND category = ?)"
+        params.append(category)
+    query += " ORDER BY timestamp DESC, link DESC LIMIT ?"
+    params.append(limit)
+
+    with _lock:
+        rows = _connect().execute(query, params).fetchall()
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    TTL付きのLRUキャッシュ
+    期限切れの値もすぐには捨てずに保持し、呼び出し側で
+    stale-while-revalidate (古い値を返しつつ裏で更新) ができるようにする
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._inflight = {}         # key -> Future (読み込み中のもの)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        (value, is_fresh) を返す
+        未登録の場合は (None, False)
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None, False
+            self._data.move_to_end(key)
+            value, expires_at = item
+            return value, time.monotonic() < expires_at
+
+    def set(self, key, value, ttl=None):
+        """
+        値を登録する。ttlを省略した場合はキャッシュ既定のTTLを使う
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            # 上限を超えたら最も使われていないものから削除
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        有効な値があればそれを返し、なければ loader() の結果を登録して返す
+        同じキーを同時に読み込もうとした場合は、最初の1回の結果を全員で待つ (single-flight)
+        loader が例外を出した場合は、待っていた呼び出し側にも同じ例外を送出する
+        """
+        value, fresh = self.get(key)
+        if fresh:
+            return value
+
+        with self._lock:
+            # 待っている間に他の呼び出しが読み込み終えていればそれを使う
+            item = self._data.get(key)
+            if item is not None and time.monotonic() < item[1]:
+                return item[0]
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[key] = Future()
+
+        if not leader:
+            return pending.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            self.set(key, value, ttl=ttl)
+            pending.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
@@ -0,0 +1,97 @@
+import sys
+from collections.abc import Mapping
+
+# キャッシュ・検索インデックスに保持する記事の表現
+# 記事ごとに dict を持つと、キーの表と同じ配信元名の文字列が記事の数だけできるので、
+# __slots__ のクラスにして配信元名は intern した1つの文字列を共有する
+# (全カテゴリの記事を保持する 256MB の Lambda で効く。スナップショットや記事ストアから
+#  読んだ記事は行ごとに別の文字列になるので、intern で1つにまとまる)
+#
+# dict と同じように entry['title'] や entry.get('image') で読めるので、呼び出し側は区別しなくてよい
+
+
+FIELDS = ('title', 'link', 'published', 'timestamp', 'summary', 'source', 'image')
+_FIELD_SET = frozenset(FIELDS)
+
+
+class Entry(Mapping):
+    """
+    記事1件 (news の記事と同じキー)
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, title, link, published, timestamp, summary, source, image):
+        self.title = title
+        self.link = link
+        self.published = published
+        self.timestamp = timestamp
+        self.summary = summary
+        self.source = sys.intern(source) if source else source
+        self.image = image
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(
+            entry.get('title'),
+            entry.get('link'),
+            entry.get('published'),
+            entry.get('timestamp', 0),
+            entry.get('summary'),
+            entry.get('source'),
+            entry.get('image'),
+        )
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    # Mapping の既定の実装は __getitem__ と例外を経由して遅いので直接読む
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return key in _FIELD_SET
+
+    def __setitem__(self, key, value):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def to_dict(self):
+        # JSONにするたびに呼ばれるので、ループを使わずに作る
+        return {
+            'title': self.title,
+            'link': self.link,
+            'published': self.published,
+            'timestamp': self.timestamp,
+            'summary': self.summary,
+            'source': self.source,
+            'image': self.image,
+        }
+
+    def __repr__(self):
+        return f"Entry({self.to_dict()!r})"
+
+
+def compact(entries):
+    """
+    記事の dict のリストを Entry のリストにする (Entry はそのまま)
+    """
+    return [entry if isinstance(entry, Entry) else Entry.from_dict(entry) for entry in entries]
+
+
+def to_dicts(entries):
+    """
+    JSONとして保存するために dict のリストに戻す
+    """
+    return [entry.to_dict() if isinstance(entry, Entry) else entry for entry in entries]
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from operator import is_
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from search import bigrams, normalize
+
+# タイトルのSimHashがこのビット数以内の差なら同じ話題の候補とする
+# (配信元名が付いただけの同じ見出しで8程度離れる)
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get('NEAR_DUP_MAX_DISTANCE', '8'))
+
+# 短いタイトルは1語違うだけでSimHashが大きく動き、別の記事でも偶然近くなる
+# (10 bigram 程度の定型の見出しで、別の記事が4〜7しか離れないことがある)
+# bigram がこの数より少ないタイトルは、数に比例して距離の上限を下げる
+NEAR_DUP_FULL_FEATURES = 24
+
+# これより短いタイトルはSimHashが安定しないので近似重複の判定に使わない
+NEAR_DUP_MIN_FEATURES = 8
+
+# 候補のタイトルの bigram の Jaccard 係数がこれ以上なら同じ話題とみなす
+# (SimHashの距離だけでは、主語だけ違う定型の見出しを区別できない)
+NEAR_DUP_MIN_SIMILARITY = float(os.environ.get('NEAR_DUP_MIN_SIMILARITY', '0.8'))
+
+SIMHASH_BITS = 64
+# 距離N以内のペアはN+1分割したブロックのどれかが必ず一致する (鳩の巣原理)
+BANDS = NEAR_DUP_MAX_DISTANCE + 1
+BAND_BITS = SIMHASH_BITS // BANDS
+
+# 記事の同一性に関係ないクエリパラメータ
+TRACKING_PARAMS = {'fbclid', 'gclid', 'ref', 'from', 'rss', 'cmpid', 'n_cid'}
+
+# key ごとの前回の入力とまとめた結果 (key -> (記事の一覧, 結果))
+# フィードのキャッシュが同じ間は同じ記事の一覧が来るので、リクエストごとにまとめ直さない
+_last = {}
+_last_lock = threading.Lock()
+
+
+@lru_cache(maxsize=16384)
+def canonical_link(link):
+    """
+    比較用にURLを正規化する
+    スキーム・www・フラグメント・末尾スラッシュ・トラッキング用パラメータの違いを無視する
+    """
+    try:
+        parts = urlsplit(link.strip())
+    except ValueError:
+        return link
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('', host, path, urlencode(query), ''))
+
+
+@lru_cache(maxsize=16384)
+def title_simhash(title):
+    """
+    タイトルの文字bigramから (64bitのSimHash, bigramの数) を計算する
+    特徴量が少なすぎる場合はNoneを返す
+    """
+    features = bigrams(normalize(title))
+    if len(features) < NEAR_DUP_MIN_FEATURES:
+        return None
+
+    # 各ビット位置で1が過半数なら1 (ビット列を文字列にして列ごとに数える)
+    half = len(features) / 2
+    value = 0
+    for column in zip(*map(_feature_bits, features)):
+        value = value << 1 | (column.count('1') > half)
+    return value, len(features)
+
+
+def max_distance(features):
+    """
+    bigram が features 個のタイトルどうしを同じ話題の候補とするSimHashの距離の上限
+    """
+    return min(NEAR_DUP_MAX_DISTANCE, NEAR_DUP_MAX_DISTANCE * features // NEAR_DUP_FULL_FEATURES)
+
+
+def title_similarity(a, b):
+    """
+    2つのタイトルの bigram の Jaccard 係数
+    """
+    a = bigrams(normalize(a))
+    b = bigrams(normalize(b))
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@lru_cache(maxsize=65536)
+def _feature_bits(feature):
+    h = hashlib.blake2b(feature.encode('utf-8'), digest_size=SIMHASH_BITS // 8).digest()
+    return format(int.from_bytes(h, 'big'), f'0{SIMHASH_BITS}b')
+
+
+def _bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(i, value >> (i * BAND_BITS) & mask) for i in range(BANDS)]
+
+
+def prepare(entries):
+    """
+    取り込んだ記事の正規化URLとSimHashを先に計算しておく (リクエスト時には計算済みのものを使う)
+    """
+    for entry in entries:
+        canonical_link(entry.get('link') or '')
+        title_simhash(entry.get('title') or '')
+
+
+def cluster(entries, key=None):
+    """
+    重複・近似重複の記事をまとめる
+    先に出てきた記事を代表とし、他の記事は代表の 'alternates' に
+    {source, link, title} として追加する (入力の順序は維持する)
+      - 同じリンクの記事は同じ記事なので1件にまとめる
+      - タイトルが近い記事は、配信元が違う場合だけまとめる
+        (同じ配信元の続報などは、代表とも alternates のどれとも配信元が同じなので別の記事として残す)
+    キャッシュ中の記事を書き換えないよう、代表はコピーしてから変更する
+    key (カテゴリなど) を指定すると、前回と同じ記事の一覧 (同じオブジェクト) なら前回の結果を返す
+    """
+    if key is not None:
+        with _last_lock:
+            last = _last.get(key)
+        if last is not None and len(last[0]) == len(entries) and all(map(is_, last[0], entries)):
+            return list(last[1])
+    result = _cluster(entries)
+    if key is not None:
+        with _last_lock:
+            _last[key] = (list(entries), result)
+    return list(result)
+
+
+def _cluster(entries):
+    result = []
+    by_link = {}    # 正規化URL -> resultの位置
+    buckets = {}    # (band番号, 値) -> resultの位置のリスト
+    hashes = []     # resultの位置 -> SimHash
+    limits = []     # resultの位置 -> 距離の上限 (max_distance)
+    sources = []    # resultの位置 -> 代表と alternates の配信元
+
+    for entry in entries:
+        link = canonical_link(entry.get('link') or '')
+        pos = by_link.get(link)
+        if pos is not None:
+            _add_alternate(result, sources, pos, entry)
+            continue
+
+        signature = title_simhash(entry.get('title') or '')
+        if signature is not None:
+            pos = _find_near_duplicate(entry, signature, buckets, hashes, limits, sources, result)
+        if pos is not None:
+            _add_alternate(result, sources, pos, entry)
+            by_link[link] = pos
+            continue
+
+        pos = len(result)
+        result.append(entry)
+        hashes.append(signature[0] if signature is not None else None)
+        limits.append(max_distance(signature[1]) if signature is not None else 0)
+        sources.append({entry.get('source')})
+        by_link[link] = pos
+        if signature is not None:
+            for band in _bands(signature[0]):
+                buckets.setdefault(band, []).append(pos)
+
+    return result
+
+
+def _find_near_duplicate(entry, signature, buckets, hashes, limits, sources, result):
+    simhash, features = signature
+    # 短いほうのタイトルに合わせた上限 (max_distance は bigram の数について単調)
+    limit = max_distance(features)
+    source = entry.get('source')
+    for band in _bands(simhash):
+        for pos in buckets.get(band, ()):
+            distance = (simhash ^ hashes[pos]).bit_count()
+            if distance > limit or distance > limits[pos]:
+                continue
+            # 同じ配信元の記事がすでにまとまっている話題には入れない (別の記事として残す)
+            if source in sources[pos]:
+                continue
+            if title_similarity(entry.get('title') or '', result[pos].get('title') or '') >= NEAR_DUP_MIN_SIMILARITY:
+                return pos
+    return None
+
+
+def _add_alternate(result, sources, pos, entry):
+    source = entry.get('source')
+    if source in sources[pos]:
+        # 同じリンクで同じ配信元 (同じ記事が複数のフィードに載っている)
+        return
+    sources[pos].add(source)
+    primary = result[pos]
+    alternates = primary.get('alternates', [])
+    primary = dict(primary)
+    primary['alternates'] = alternates + [{
+        'source': source,
+        'link': entry.get('link'),
+        'title': entry.get('title')
+    }]
+    result[pos] = primary
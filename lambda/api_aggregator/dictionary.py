@@ -0,0 +1,242 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import files
+import metrics
+import upstream
+from cache import TTLCache
+
+# Free Dictionary API の検索結果を単語ごとに保持するモジュール
+# 出題する単語は business_words.json の固定リストなので、事前に取得した結果
+# (dictionary_cache.json) を同梱し、そこにない単語だけを取得して /tmp に追記する
+#
+# 同梱ファイルの作成 (デプロイ前に実行):
+#     python lambda/api_aggregator/dictionary.py
+
+DICTIONARY_URL = 'https://api.dictionaryapi.dev/api/v2/entries/en/'
+metrics.register_hosts(DICTIONARY_URL)
+
+# 同梱の検索結果
+BUNDLED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dictionary_cache.json')
+
+# 実行中に取得した結果の保存先 (ウォームなコンテナ間では /tmp が残る)
+DICTIONARY_CACHE_PATH = os.environ.get('DICTIONARY_CACHE_PATH', '/tmp/dictionary_cache.json')
+
+# メモリに保持する単語数
+DICTIONARY_CACHE_MAX_ENTRIES = int(os.environ.get('DICTIONARY_CACHE_MAX_ENTRIES', '2048'))
+
+# 見つかった単語を保持する時間 (秒)。辞書の内容はほぼ変わらないので長めにする
+DICTIONARY_CACHE_TTL = int(os.environ.get('DICTIONARY_CACHE_TTL', str(30 * 24 * 3600)))
+
+# 辞書に載っていなかった単語 (404) を再検索しない時間 (秒)
+DICTIONARY_NEGATIVE_TTL = int(os.environ.get('DICTIONARY_NEGATIVE_TTL', str(24 * 3600)))
+
+_cache = TTLCache(ttl=DICTIONARY_CACHE_TTL, maxsize=DICTIONARY_CACHE_MAX_ENTRIES)
+
+# ファイルから読み込んだ記録: 単語 -> {"details": 詳細またはNone, "fetched_at": 取得時刻}
+_records = None
+_records_lock = threading.Lock()
+
+
+class NotInDictionary(Exception):
+    pass
+
+
+def normalize_word(word):
+    return word.strip().lower()
+
+
+def lookup(word):
+    """
+    単語の詳細 (word, phonetic, definition, example, audio) を返す
+    辞書に載っていない・取得に失敗した場合は None
+    """
+    key = normalize_word(word)
+    details, fresh = _cache.get(key)
+    if fresh:
+        metrics.incr('dictionary_hit')
+        return details
+
+    record = _load_records().get(key)
+    if record is not None and _record_fresh(record):
+        metrics.incr('dictionary_hit')
+        _cache.set(key, record['details'], ttl=_record_ttl(record))
+        return record['details']
+
+    metrics.incr('dictionary_miss')
+    try:
+        details = fetch(key)
+    except NotInDictionary:
+        details = None
+    except Exception as e:
+        # 通信エラーは記録せず、次回また取得する
+        print(f"Error fetching word details: {e}")
+        return None
+
+    record = {'details': details, 'fetched_at': time.time()}
+    _cache.set(key, details, ttl=_record_ttl(record))
+    _save_record(key, record)
+    return details
+
+
+def fetch(word):
+    """
+    Free Dictionary API から取得して整形する
+    辞書に載っていない場合は NotInDictionary を送出する
+    """
+    response = upstream.get(DICTIONARY_URL + quote(word), timeout=5)
+    if response.status_code == 404:
+        raise NotInDictionary(word)
+    response.raise_for_status()
+    data = response.json()
+    if not isinstance(data, list) or len(data) == 0:
+        raise NotInDictionary(word)
+    return normalize_entry(data[0])
+
+
+def normalize_entry(entry):
+    """
+    APIのレスポンスの1件目から、表示に使う項目だけを取り出す
+    """
+    meanings = entry.get('meanings', [])
+    definition = "No definition found."
+    example = None
+
+    # 最初の定義と例文を取得
+    for m in meanings:
+        for d in m.get('definitions', []):
+            if not definition or definition == "No definition found.":
+                definition = d.get('definition')
+            if 'example' in d:
+                example = d.get('example')
+            if definition and example:
+                break
+        if definition and example:
+            break
+
+    # 音声URLの取得
+    audio = None
+    for phon in entry.get('phonetics', []):
+        if phon.get('audio'):
+            audio = phon.get('audio')
+            break
+
+    return {
+        "word": entry.get('word'),
+        "phonetic": entry.get('phonetic'),
+        "definition": definition,
+        "example": example,
+        "audio": audio
+    }
+
+
+def _record_ttl(record):
+    # 同梱ファイルの検索結果 (fetched_at なし) はデプロイごとに作り直すので期限を設けない
+    if record.get('fetched_at') is None:
+        return DICTIONARY_CACHE_TTL
+    ttl = DICTIONARY_CACHE_TTL if record['details'] is not None else DICTIONARY_NEGATIVE_TTL
+    return ttl - (time.time() - record['fetched_at'])
+
+
+def _record_fresh(record):
+    return _record_ttl(record) > 0
+
+
+def _load_records():
+    """
+    同梱ファイルと /tmp のファイルを初回だけ読み込む (/tmp の記録を優先)
+    """
+    global _records
+    if _records is not None:
+        return _records
+    with _records_lock:
+        if _records is None:
+            records = {}
+            for path in (BUNDLED_PATH, DICTIONARY_CACHE_PATH):
+                records.update(_read_file(path))
+            _records = records
+    return _records
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error loading dictionary cache {path}: {e}")
+        return {}
+
+
+def _save_record(key, record):
+    """
+    取得した結果を /tmp のファイルに追記する
+    server.py のワーカーは別プロセスで記録を持つので、ロックを取ってからファイルを読み直し、
+    他のワーカーが追記した記録とまとめて書き込む (同じ単語は取得時刻が新しい方を残す)
+    """
+    records = _load_records()
+    with _records_lock:
+        records[key] = record
+        try:
+            with open(DICTIONARY_CACHE_PATH + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                for k, v in _read_file(DICTIONARY_CACHE_PATH).items():
+                    current = records.get(k)
+                    if current is None or (current.get('fetched_at') or 0) < (v.get('fetched_at') or 0):
+                        records[k] = v
+                added = {k: v for k, v in records.items() if v.get('fetched_at') is not None}
+                _write_file(DICTIONARY_CACHE_PATH, added)
+        except OSError as e:
+            print(f"Error saving dictionary cache: {e}")
+
+
+def _write_file(path, records):
+    files.write_atomic(path, json.dumps(records, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+
+
+def build(words, path=BUNDLED_PATH, concurrency=4):
+    """
+    words の検索結果をまとめて取得し、同梱ファイルとして書き出す
+    取得に失敗した単語は書き出さない (実行時に取得する)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch_one(word):
+        try:
+            return word, fetch(word)
+        except NotInDictionary:
+            return word, None
+        except Exception as e:
+            print(f"Error fetching {word}: {e}")
+            return word, e
+
+    keys = sorted({normalize_word(word) for word in words})
+    records = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for word, details in executor.map(fetch_one, keys):
+            if isinstance(details, Exception):
+                continue
+            records[word] = {'details': details}
+    _write_file(path, records)
+    return records
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import english
+
+    parser = argparse.ArgumentParser(description='business_words.json の単語の検索結果を同梱ファイルとして書き出す')
+    parser.add_argument('--output', default=BUNDLED_PATH)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    words = [entry['word'] for entry in english.load_words()]
+    records = build(words, path=args.output, concurrency=args.concurrency)
+    found = sum(1 for record in records.values() if record['details'] is not None)
+    print(f"Wrote {len(records)} words ({found} found) to {args.output}")
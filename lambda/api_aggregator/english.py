@@ -1,8 +1,10 @@
-import requests
 import random
 import json
 import os
 import re
+import threading
+
+import dictionary
 
 def load_words():
     """
@@ -23,62 +25,89 @@ def load_words():
             {"word": "negotiate", "meaning_ja": "交渉する", "example": "We must negotiate."}
         ]
 
-WORDS = load_words()
+# 例文中の出題単語を隠す文字列
+BLANK = '_______'
+
+# 1回のリクエストで生成できるクイズの上限
+MAX_QUIZ_COUNT = 50
+
+
+class Vocabulary:
+    """
+    単語リストと、クイズ生成用に前計算したデータ (単語を隠した例文)
+    """
+
+    def __init__(self, words):
+        self.words = []
+        seen = set()
+        for entry in words:
+            # 同じ単語が重複している場合は最初のものを使う
+            if entry['word'] in seen:
+                continue
+            seen.add(entry['word'])
+            self.words.append(entry)
+        self.masked_examples = [
+            mask_word(entry['example'], entry['word']) if entry.get('example') else ''
+            for entry in self.words
+        ]
+
+    def __len__(self):
+        return len(self.words)
+
+
+def mask_word(text, word):
+    """
+    text 中の word を大文字小文字を無視して BLANK に置き換える
+    """
+    lowered = text.lower()
+    target = word.lower()
+    if not target or len(lowered) != len(text) or len(target) != len(word):
+        # 小文字にすると長さが変わる文字を含む場合は位置がずれるので正規表現で置換する
+        return re.sub(re.escape(word), BLANK, text, flags=re.IGNORECASE)
+
+    parts = []
+    start = 0
+    while True:
+        pos = lowered.find(target, start)
+        if pos < 0:
+            break
+        parts.append(text[start:pos])
+        parts.append(BLANK)
+        start = pos + len(target)
+    parts.append(text[start:])
+    return ''.join(parts)
+
+
+# business_words.json はクイズ・単語のリクエストが来たときに初めて読み込む
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+def vocabulary():
+    global _vocabulary
+    if _vocabulary is not None:
+        return _vocabulary
+    with _vocabulary_lock:
+        if _vocabulary is None:
+            _vocabulary = Vocabulary(load_words())
+    return _vocabulary
 
 def get_word_details(word):
     """
     Free Dictionary APIから単語の詳細を取得
+    (同梱・取得済みの検索結果があればネットワークにはアクセスしない)
     """
-    url = f"https://api.dictionaryapi.dev/api/v2/entries/en/{word}"
-    try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, list) and len(data) > 0:
-                entry = data[0]
-                meanings = entry.get('meanings', [])
-                definition = "No definition found."
-                example = None
-
-                # 最初の定義と例文を取得
-                for m in meanings:
-                    for d in m.get('definitions', []):
-                        if not definition or definition == "No definition found.":
-                            definition = d.get('definition')
-                        if 'example' in d:
-                            example = d.get('example')
-                        if definition and example:
-                            break
-                    if definition and example:
-                        break
-
-                # 音声URLの取得
-                audio = None
-                for phon in entry.get('phonetics', []):
-                    if phon.get('audio'):
-                        audio = phon.get('audio')
-                        break
-
-                return {
-                    "word": entry.get('word'),
-                    "phonetic": entry.get('phonetic'),
-                    "definition": definition,
-                    "example": example,
-                    "audio": audio
-                }
-    except Exception as e:
-        print(f"Error fetching word details: {e}")
-
-    return None
+    return dictionary.lookup(word)
 
 def get_word_of_the_day():
     """
     ランダムに単語を選び、詳細情報を付加して返す
     """
-    if not WORDS:
+    words = vocabulary().words
+    if not words:
         return {"error": "No words available"}
 
-    word_entry = random.choice(WORDS)
+    word_entry = random.choice(words)
     details = get_word_details(word_entry['word'])
 
     result = {
@@ -96,33 +125,38 @@ def get_word_of_the_day():
 
     return result
 
-def get_quiz():
+def get_quiz(count=None):
     """
     4択クイズを生成する
+    count を指定した場合は count 問分のクイズをリストで返す
     """
-    if len(WORDS) < 4:
+    vocab = vocabulary()
+    if len(vocab) < 4:
         return {"error": "Not enough words for quiz"}
 
-    correct = random.choice(WORDS)
-    # 正解以外の単語から3つ選ぶ
-    others = random.sample([w for w in WORDS if w['word'] != correct['word']], 3)
+    if count is None:
+        return _build_quiz(vocab)
+    count = min(max(int(count), 1), MAX_QUIZ_COUNT)
+    return [_build_quiz(vocab) for _ in range(count)]
 
-    options = others + [correct]
-    random.shuffle(options)
+def _build_quiz(vocab):
+    words = vocab.words
+    size = len(words)
+    correct = random.randrange(size)
+    # 正解以外の単語から3つ選ぶ (リストをコピーせず位置だけを抽選する)
+    # 正解を除いた size - 1 個の位置から選び、正解の位置以降は1つずらす
+    picks = [i + 1 if i >= correct else i for i in random.sample(range(size - 1), 3)]
 
-    # 例文の処理 (単語を隠す)
-    example_hint = ""
-    if correct.get('example'):
-        word_esc = re.escape(correct['word'])
-        # 大文字小文字を無視して置換
-        example_hint = re.sub(word_esc, '_______', correct['example'], flags=re.IGNORECASE)
+    options = picks + [correct]
+    random.shuffle(options)
 
+    word = words[correct]['word']
     return {
-        "question": f"What is the meaning of '{correct['word']}'?",
-        "correct_word": correct['word'], # フロントでの確認用
-        "example": example_hint,
+        "question": f"What is the meaning of '{word}'?",
+        "correct_word": word, # フロントでの確認用
+        "example": vocab.masked_examples[correct],
         "options": [
-            {"label": w['meaning_ja'], "word": w['word'], "is_correct": (w['word'] == correct['word'])}
-            for w in options
+            {"label": words[i]['meaning_ja'], "word": words[i]['word'], "is_correct": (i == correct)}
+            for i in options
         ]
     }
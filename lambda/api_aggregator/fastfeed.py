@@ -0,0 +1,133 @@
+import io
+import re
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from email.utils import mktime_tz, parsedate_tz
+
+# feedparserを使わない軽量パーサー
+# XMLを先頭から1回だけ読み、記事ごとに必要な値 (タイトル・リンク・日時・画像) だけを取り出す
+# 読み終わった記事の要素はすぐに破棄するので、フィード全体のオブジェクトを保持しない
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+MEDIA = '{http://search.yahoo.com/mrss/}'
+
+ITEM_TAGS = {'item', 'entry'}
+FEED_TAGS = {'channel', 'feed'}
+
+IMG_RE = re.compile(r'<img[^>]+src=["\'](.*?)["\']', re.IGNORECASE)
+
+
+def _local(tag):
+    return tag.rpartition('}')[2]
+
+
+def parse(data):
+    """
+    フィードのバイト列をパースして (フィードのタイトル, 記事のリスト) を返す
+    記事は news._parse_entries と同じキーを持つが、summary は未加工のまま
+    XMLとして不正な場合は xml.etree.ElementTree.ParseError を送出する
+    """
+    feed_title = ''
+    entries = []
+    depth_names = []
+
+    for event, elem in ET.iterparse(io.BytesIO(data), events=('start', 'end')):
+        name = _local(elem.tag)
+        if event == 'start':
+            depth_names.append(name)
+            continue
+
+        depth_names.pop()
+        if name in ITEM_TAGS:
+            entries.append(_parse_item(elem))
+            # 処理済みの記事は破棄してメモリを抑える
+            elem.clear()
+        elif name == 'title' and not feed_title and depth_names and depth_names[-1] in FEED_TAGS:
+            feed_title = (elem.text or '').strip()
+
+    for entry in entries:
+        entry['source'] = feed_title
+    return feed_title, entries
+
+
+def _parse_item(item):
+    title = ''
+    link = ''
+    date_text = None
+    updated_text = None
+    image_url = None
+    summary = ''
+    content = ''
+
+    for child in item:
+        tag = child.tag
+        name = _local(tag)
+        if name == 'title':
+            title = (child.text or '').strip()
+        elif name == 'link':
+            if tag.startswith(ATOM):
+                rel = child.get('rel', 'alternate')
+                if rel == 'alternate' and not link:
+                    link = child.get('href', '')
+                elif not image_url and child.get('type', '').startswith('image/'):
+                    image_url = child.get('href')
+            elif not link:
+                link = (child.text or '').strip()
+        elif name in ('pubDate', 'published', 'date', 'issued'):
+            date_text = date_text or child.text
+        elif name in ('updated', 'modified'):
+            updated_text = updated_text or child.text
+        elif name == 'enclosure':
+            if not image_url and child.get('type', '').startswith('image/'):
+                image_url = child.get('url')
+        elif tag == MEDIA + 'content':
+            if not image_url and child.get('medium') == 'image':
+                image_url = child.get('url')
+        elif tag == MEDIA + 'thumbnail':
+            if not image_url:
+                image_url = child.get('url')
+        elif name in ('description', 'summary'):
+            summary = summary or (child.text or '')
+        elif name in ('encoded', 'content'):
+            content = content or (child.text or '')
+
+    # 本文中の <img src="..."> は要約・本文を連結せず順に探す
+    if not image_url:
+        for text in (summary, content):
+            if text:
+                match = IMG_RE.search(text)
+                if match:
+                    image_url = match.group(1)
+                    break
+
+    timestamp = _parse_date(date_text) or _parse_date(updated_text)
+    pub_date = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp else ''
+
+    return {
+        'title': title,
+        'link': link,
+        'published': pub_date,
+        'timestamp': timestamp,
+        'summary': summary or content,
+        'source': '',
+        'image': image_url
+    }
+
+
+def _parse_date(text):
+    """
+    RFC 822 (RSS 2.0) / ISO 8601 (Atom, RSS 1.0のdc:date) の日時をUNIX時刻にする
+    解釈できない場合は0
+    """
+    if not text:
+        return 0
+    text = text.strip()
+    parsed = parsedate_tz(text)
+    if parsed:
+        return float(mktime_tz(parsed))
+    try:
+        dt = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return 0
+    return dt.timestamp()
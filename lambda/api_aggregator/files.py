@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+# ファイルの書き込みの共通処理
+
+
+def write_atomic(path, data):
+    """
+    data (バイト列) を path に書き込む
+    書きかけのファイルを読まれないように、同じディレクトリの一時ファイルに書いてから置き換える
+    (一時ファイルの名前は mkstemp で決めるので、server.py のワーカーやスレッドが同時に書いても衝突しない)
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix='.tmp', dir=directory or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
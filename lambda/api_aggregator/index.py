@@ -1,8 +1,49 @@
 import json
-import news
-import weather
-import steam
-import english
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import responses
+import upstream
+
+# news / weather / steam / english はルートの処理の中で import する
+# (コールドスタート時に、そのリクエストで使わないモジュールや依存ライブラリを読み込まないため)
+
+# 複数ルートをまとめて処理するときのスレッド
+# (各モジュール内の並列取得と同じスレッドプールを使うと待ち合わせで詰まるため分ける)
+_route_executor = ThreadPoolExecutor(max_workers=8)
+
+# /dashboard でまとめて返せるセクション: 名前 -> (パス, 受け付けるクエリパラメータ)
+DASHBOARD_SECTIONS = {
+    'news': ('/news', ('category', 'fields', 'limit')),
+    'weather': ('/weather', ('lat', 'lon', 'hours', 'format')),
+    'steam': ('/steam', ()),
+    'word': ('/english/word', ()),
+    'quiz': ('/english/quiz', ()),
+}
+
+# /dashboard 全体の締め切り (秒)。各セクションの締め切りもこれを超えない
+DASHBOARD_DEADLINE = float(os.environ.get('DASHBOARD_DEADLINE', '9'))
+
+# モジュール内に締め切りがないセクションの締め切り (秒)
+SECTION_DEADLINE = 6
+
+# ルートの一覧 (メトリクスの Route に使う名前)
+# ルーティングはパスの末尾で判定するので /api/xxx/news も /news として処理される
+# 生のパスをメトリクスに使うと値が際限なく増えるので、一致したルートの名前か UNMATCHED_ROUTE にする
+ROUTES = (
+    '/news', '/news/search', '/news/stats', '/news/schedule',
+    '/weather',
+    '/steam', '/steam/sales', '/steam/new', '/steam/popular',
+    '/upstream/stats',
+    '/dashboard',
+    '/english/word', '/english/quiz',
+    '/thumb',
+)
+UNMATCHED_ROUTE = 'unmatched'
+
+class NotFound(Exception):
+    pass
 
 def handler(event, context):
     """
@@ -13,6 +54,8 @@ def handler(event, context):
     path = event.get('rawPath') or event.get('path', '/')
     method = event.get('requestContext', {}).get('http', {}).get('method') or event.get('httpMethod', 'GET')
     query_params = event.get('queryStringParameters') or {}
+    # v1 ではヘッダー名の大文字小文字がそのまま来るので小文字に揃える
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
 
     # CORS Headers
     headers = {
@@ -30,61 +73,295 @@ def handler(event, context):
             'body': ''
         }
 
+    request_metrics = metrics.start(route_name(path))
+    response = respond(path, query_params, headers, request_headers)
+    if response['statusCode'] == 404:
+        request_metrics.route = UNMATCHED_ROUTE
+
+    # debug=timing の場合は処理時間の内訳を Server-Timing ヘッダーで返す
+    if query_params.get('debug') == 'timing':
+        response['headers']['Server-Timing'] = request_metrics.server_timing()
+    metrics.emit(request_metrics, response['statusCode'])
+    return response
+
+def route_name(path):
+    """
+    パスに一致するルートの名前 (ROUTES のいずれか。一致しなければ UNMATCHED_ROUTE)
+    """
+    for name in ROUTES:
+        if path.endswith(name):
+            return name
+    return UNMATCHED_ROUTE
+
+def respond(path, query_params, headers, request_headers):
+    """
+    ルートを処理してレスポンスを組み立てる (エラーはステータスコードに変換する)
+    """
+    if path.endswith('/thumb'):
+        # 画像はJSONではないので別に組み立てる
+        return thumbnail(query_params, headers, request_headers)
+
     try:
-        body = {}
-
-        # Routing logic
-
-        # News
-        if path.endswith('/news'):
-            category = query_params.get('category')
-            body = news.fetch_news(category=category)
-        elif path.endswith('/news/search'):
-            keyword = query_params.get('q')
-            body = news.fetch_news(keyword=keyword)
-
-        # Weather
-        elif path.endswith('/weather'):
-            lat = query_params.get('lat')
-            lon = query_params.get('lon')
-            body = weather.get_weather(lat=lat, lon=lon)
-
-        # Steam
-        elif path.endswith('/steam/sales'):
-            info = steam.get_steam_info()
-            body = info.get('sales', [])
-        elif path.endswith('/steam/new'):
-            info = steam.get_steam_info()
-            body = info.get('new_releases', [])
-        elif path.endswith('/steam/popular'):
-            info = steam.get_steam_info()
-            body = info.get('top_sellers', [])
-
-        # English
-        elif path.endswith('/english/word'):
-            body = english.get_word_of_the_day()
-        elif path.endswith('/english/quiz'):
-            body = english.get_quiz()
+        body = route(path, query_params)
+        headers['Cache-Control'] = cache_control(path, query_params, body)
+        entries = count_entries(body)
+        if entries is not None:
+            metrics.incr('entries', entries)
+        with metrics.timer('serialize'):
+            return responses.build_json(200, headers, body, request_headers)
 
-        else:
-            return {
-                'statusCode': 404,
-                'headers': headers,
-                'body': json.dumps({'error': 'Not Found', 'path': path})
-            }
+    except NotFound:
+        headers['Cache-Control'] = 'no-store'
+        return {
+            'statusCode': 404,
+            'headers': headers,
+            'body': json.dumps({'error': 'Not Found', 'path': path})
+        }
 
+    except ValueError as e:
+        # 不正なクエリパラメータ
+        headers['Cache-Control'] = 'no-store'
         return {
-            'statusCode': 200,
+            'statusCode': 400,
             'headers': headers,
-            'body': json.dumps(body, ensure_ascii=False)
+            'body': json.dumps({'error': str(e)})
         }
 
     except Exception as e:
         print(f"Error handling request: {e}")
         import traceback
         traceback.print_exc()
+        headers['Cache-Control'] = 'no-store'
         return {
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({'error': str(e)})
         }
+
+def thumbnail(query_params, headers, request_headers):
+    """
+    /thumb?url=...&w=...&s=... 縮小した画像を返す
+    """
+    import thumbs
+
+    def error(status_code, message):
+        headers['Cache-Control'] = 'no-store'
+        return {
+            'statusCode': status_code,
+            'headers': headers,
+            'body': json.dumps({'error': message})
+        }
+
+    try:
+        data, content_type, digest = thumbs.get_thumbnail(
+            query_params.get('url'), query_params.get('w'), query_params.get('s')
+        )
+    except (thumbs.InvalidSignature, thumbs.ForbiddenHost) as e:
+        return error(403, str(e))
+    except thumbs.UnsupportedImage as e:
+        return error(415, str(e))
+    except thumbs.ImageTooLarge as e:
+        return error(413, str(e))
+    except thumbs.Redirect as e:
+        # 縮小できない環境では元の画像を直接取得してもらう
+        headers['Location'] = e.url
+        headers['Cache-Control'] = f'public, max-age={thumbs.THUMB_MAX_AGE}'
+        return {'statusCode': 302, 'headers': headers, 'body': ''}
+    except ValueError as e:
+        return error(400, str(e))
+    except Exception as e:
+        print(f"Error building thumbnail: {e}")
+        return error(502, str(e))
+
+    headers['Content-Type'] = content_type
+    headers['Cache-Control'] = f'public, max-age={thumbs.THUMB_MAX_AGE}'
+    return responses.build_binary(headers, data, digest, request_headers)
+
+def count_entries(body):
+    """
+    レスポンスに含まれる件数 (一覧を返すルートのみ、それ以外は None)
+    """
+    if isinstance(body, list):
+        return len(body)
+    if isinstance(body, dict) and isinstance(body.get('items'), list):
+        return len(body['items'])
+    return None
+
+def cache_control(path, query_params, body):
+    """
+    ルートごとの Cache-Control (上流のデータが更新されるまでの時間だけキャッシュさせる)
+    """
+    if isinstance(body, dict) and body.get('error'):
+        # モジュール側で失敗を {"error": ...} として返したもの
+        return 'no-store'
+    if path.endswith('/dashboard'):
+        if body.get('errors'):
+            # 一部のセクションが欠けた結果はキャッシュさせない
+            return 'no-store'
+        names = body.get('sections', {})
+        ages = [max_age(DASHBOARD_SECTIONS[name][0], query_params) for name in names]
+        age = None if not ages or None in ages else min(ages)
+    else:
+        age = max_age(path, query_params)
+    if age is None:
+        return 'no-store'
+    return f'public, max-age={int(age)}'
+
+def max_age(path, query_params=None):
+    """
+    キャッシュしてよい秒数 (None はキャッシュさせない)
+    """
+    query_params = query_params or {}
+    if path.endswith('/news'):
+        import news
+        # フィードのキャッシュ (サーバー側) と同じく、フィードの取得間隔に合わせる
+        return news.cache_max_age(category=query_params.get('category'))
+    if path.endswith('/news/search'):
+        import news
+        return news.cache_max_age(keyword=query_params.get('q') or '*')
+    if path.endswith('/weather'):
+        import weather
+        return weather.seconds_until_update()
+    if path.endswith('/steam') or '/steam/' in path:
+        import steam
+        return steam.STEAM_CACHE_TTL
+    # /news/stats・/news/schedule・/upstream/stats は集計値、/english はリクエストごとにランダムに選ぶのでキャッシュしない
+    return None
+
+def route(path, query_params):
+    """
+    パスに対応するモジュールを呼び出してレスポンスのボディを返す
+    該当するルートがない場合は NotFound を送出する
+    """
+    # News
+    if path.endswith('/news'):
+        import news
+        category = query_params.get('category')
+        fields = query_params.get('fields')
+        # since を指定した場合は、その時刻より新しい記事だけを返す (差分の取得用)
+        entries = news.fetch_news(category=category, since=query_params.get('since'))
+        # limit/cursor が指定された場合はページ単位で返す
+        if query_params.get('limit') or query_params.get('cursor'):
+            items, next_cursor = news.paginate(
+                entries,
+                limit=query_params.get('limit'),
+                cursor=query_params.get('cursor')
+            )
+            return {'items': news.project(items, fields), 'next_cursor': next_cursor}
+        return news.project(entries, fields)
+    if path.endswith('/news/search'):
+        import news
+        keyword = query_params.get('q')
+        offset = news.parse_offset(query_params.get('offset'))
+        limit = news.parse_limit(query_params.get('limit'))
+        entries = news.fetch_news(keyword=keyword, offset=offset, limit=limit)
+        return news.project(entries, query_params.get('fields'))
+    if path.endswith('/news/stats'):
+        import news
+        return news.get_feed_stats()
+    if path.endswith('/news/schedule'):
+        # フィードごとの取得間隔・次の取得時刻と、その元になった更新頻度・応答時間・エラー率
+        import news
+        return news.get_schedule()
+
+    # Weather
+    if path.endswith('/weather'):
+        import weather
+        lat = query_params.get('lat')
+        lon = query_params.get('lon')
+        return weather.get_weather(
+            lat=lat,
+            lon=lon,
+            hours=query_params.get('hours'),
+            format=query_params.get('format')
+        )
+
+    # Steam
+    if path.endswith('/steam') or '/steam/' in path:
+        import steam
+        if path.endswith('/steam'):
+            # セール・新作・人気をまとめて返す
+            return steam.get_steam_info()
+        if path.endswith('/steam/sales'):
+            return steam.get_steam_info().get('sales', [])
+        if path.endswith('/steam/new'):
+            return steam.get_steam_info().get('new_releases', [])
+        if path.endswith('/steam/popular'):
+            return steam.get_steam_info().get('top_sellers', [])
+
+    # 上流ごとの応答時間・エラー率・サーキットブレーカーの状態
+    if path.endswith('/upstream/stats'):
+        return upstream.get_host_stats()
+
+    # Dashboard
+    if path.endswith('/dashboard'):
+        return dashboard(query_params)
+
+    # English
+    if path.endswith('/english/word'):
+        import english
+        return english.get_word_of_the_day()
+    if path.endswith('/english/quiz'):
+        import english
+        return english.get_quiz(count=query_params.get('count'))
+
+    raise NotFound(path)
+
+def route_many(requests, deadline=None):
+    """
+    {名前: (パス, クエリパラメータ)} を並列に処理して {名前: ボディまたは例外} を返す
+    deadline は upstream.run_all と同じく全体で1つ、または {名前: 締め切り}
+    """
+    calls = {
+        name: (lambda path=path, params=params: route(path, params))
+        for name, (path, params) in requests.items()
+    }
+    return upstream.run_all(calls, deadline=deadline, executor=_route_executor)
+
+def dashboard(query_params):
+    """
+    初回表示に必要なセクションを1回のリクエストでまとめて返す
+    sections=news,weather,... で対象を指定 (省略時はすべて)
+    その他のクエリパラメータは、受け付けるセクションにそのまま渡す
+    失敗・締め切り超過したセクションは errors に理由を入れ、残りのセクションは返す
+    """
+    names = query_params.get('sections')
+    names = [name.strip() for name in names.split(',') if name.strip()] if names else list(DASHBOARD_SECTIONS)
+    unknown = [name for name in names if name not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(unknown)}")
+
+    requests = {}
+    deadlines = {}
+    for name in names:
+        path, keys = DASHBOARD_SECTIONS[name]
+        requests[name] = (path, {key: query_params[key] for key in keys if query_params.get(key)})
+        deadlines[name] = upstream.deadline_after(min(section_deadline(name), DASHBOARD_DEADLINE))
+
+    sections = {}
+    errors = {}
+    for name, body in route_many(requests, deadline=deadlines).items():
+        if isinstance(body, upstream.DeadlineExceeded):
+            errors[name] = 'Deadline exceeded'
+        elif isinstance(body, Exception):
+            print(f"Error building dashboard section {name}: {body}")
+            errors[name] = str(body)
+        elif isinstance(body, dict) and 'error' in body:
+            # モジュール側で失敗を {"error": ...} として返したもの
+            errors[name] = body['error']
+        else:
+            sections[name] = body
+    return {'sections': sections, 'errors': errors}
+
+def section_deadline(name):
+    """
+    /dashboard のセクションの締め切り (秒)
+    モジュール内の締め切りで部分的な結果を返せるよう、少しだけ余裕を持たせる
+    """
+    if name == 'news':
+        import news
+        return news.NEWS_DEADLINE + 1
+    if name == 'weather':
+        import weather
+        return weather.WEATHER_DEADLINE + 1
+    return SECTION_DEADLINE
@@ -0,0 +1,97 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import news
+import polling
+import snapshots
+import steam
+import weather
+from prefectures import PREFECTURES
+
+# 天気を取り込む地点 ("lat,lon;lat,lon" 形式)。未設定なら全都道府県庁所在地
+INGEST_WEATHER_LOCATIONS = os.environ.get('INGEST_WEATHER_LOCATIONS', '')
+
+# 次の取り込みまでに取得間隔が来るフィードも今回取得する (秒)
+# (EventBridgeのスケジュールの半分程度。取得間隔が来てから次の取り込みまで待たせないため)
+INGEST_POLL_AHEAD = int(os.environ.get('INGEST_POLL_AHEAD', '450'))
+
+# Open-Meteoへの同時リクエスト数
+WEATHER_CONCURRENCY = 4
+
+
+def handler(event, context):
+    """
+    取り込み用Lambdaハンドラー
+    EventBridgeのスケジュールから定期的に起動され、
+    ニュース・Steam・天気を上流から取得してスナップショットとして保存する
+    APIのハンドラー (index.handler) はこのスナップショットだけを読む
+    """
+    if not snapshots.enabled():
+        raise RuntimeError("SNAPSHOT_STORE is not configured")
+
+    started = time.time()
+    result = {
+        'news': ingest_news(),
+        'steam': ingest_steam(),
+        'weather': ingest_weather()
+    }
+    result['duration_sec'] = round(time.time() - started, 3)
+    print(f"Ingestion finished: {result}")
+    return result
+
+
+def ingest_news():
+    """
+    取得間隔が来たフィードを取得してフィード単位で保存する
+    フィードごとの取得間隔 (polling) は更新頻度から決まり、観測値はスナップショットとして引き継ぐ
+    """
+    polling.load(snapshots.read(news.SCHEDULE_KEY, max_age=None))
+    urls = [url for urls in news.FEED_URLS.values() for url in urls]
+    now = time.time()
+    due = [url for url in urls if polling.due(url, now + INGEST_POLL_AHEAD)]
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        counts = list(executor.map(lambda url: len(news.ingest_feed(url)), due))
+    snapshots.write(news.SCHEDULE_KEY, polling.dump())
+    return {'feeds': len(urls), 'polled': len(due), 'entries': sum(counts)}
+
+
+def ingest_steam():
+    try:
+        info = steam.fetch_steam_info()
+    except Exception as e:
+        print(f"Error fetching Steam info: {e}")
+        return {'error': str(e)}
+    snapshots.write(steam.SNAPSHOT_KEY, info)
+    return {section: len(games) for section, games in info.items()}
+
+
+def ingest_weather():
+    """
+    主要地点の天気 (上流のレスポンス) を取得して保存する
+    取得に失敗した地点は前回のスナップショットを残す
+    """
+    def ingest_location(point):
+        try:
+            raw = weather.fetch_raw(*point)
+        except Exception as e:
+            print(f"Error fetching weather {point}: {e}")
+            return False
+        snapshots.write(weather.snapshot_key(*point), raw)
+        return True
+
+    # 近い地点は同じ格子点にまとまるので、格子点単位で取得する
+    locations = sorted({weather.grid_point(lat, lon) for lat, lon in weather_locations()})
+    with ThreadPoolExecutor(max_workers=WEATHER_CONCURRENCY) as executor:
+        results = list(executor.map(ingest_location, locations))
+    return {'locations': len(locations), 'failed': results.count(False)}
+
+
+def weather_locations():
+    if INGEST_WEATHER_LOCATIONS:
+        locations = []
+        for pair in INGEST_WEATHER_LOCATIONS.split(';'):
+            lat, lon = pair.split(',')
+            locations.append((float(lat), float(lon)))
+        return locations
+    return [(p['lat'], p['lon']) for p in PREFECTURES]
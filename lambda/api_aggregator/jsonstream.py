@@ -0,0 +1,96 @@
+import json
+import os
+
+from compact import Entry
+
+# レスポンスのJSONを少しずつ書き出すエンコーダー
+# json.dumps は全体の文字列を一度に作るので、記事の多いレスポンスでは
+# 文字列・UTF-8のバイト列・圧縮後のバイト列が同時にメモリに載る
+# iterencode はリストを少しずつエンコードしてチャンク単位で返すので、
+# 呼び出し側 (responses.build_json) でチャンクごとに圧縮すれば全体の文字列を作らずに済む
+#
+# 出力は json.dumps(obj, ensure_ascii=False) と同じ文字列になる (ETag が変わらないように)
+# json.JSONEncoder.iterencode は純Pythonの実装で遅いので、リストの一部ずつ C 実装の encode に渡す
+
+# 1チャンクの目安の大きさ (文字数)
+CHUNK_SIZE = 64 * 1024
+
+# リストを一度にエンコードする要素数 (記事1件が数百バイトなので、1チャンク分程度)
+BATCH_ITEMS = 100
+
+# リストの要素数の合計がこれより少ない値は分けずに一度にエンコードする
+# (小さいレスポンスは要素ごとに分けるほうが遅い)
+STREAM_MIN_ITEMS = int(os.environ.get('JSON_STREAM_MIN_ITEMS', '500'))
+
+
+def _default(obj):
+    if isinstance(obj, Entry):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_encode = json.JSONEncoder(ensure_ascii=False, default=_default).encode
+
+
+def dumps(obj):
+    """
+    json.dumps(obj, ensure_ascii=False) と同じ (Entry も dict としてエンコードする)
+    """
+    return _encode(obj)
+
+
+def iterencode(obj, chunk_size=CHUNK_SIZE):
+    """
+    obj をJSONにした文字列を chunk_size 程度のチャンクに分けて返す
+    """
+    if _count_items(obj) < STREAM_MIN_ITEMS:
+        yield _encode(obj)
+        return
+
+    parts = []
+    size = 0
+    for part in _iterencode(obj):
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts)
+
+
+def _count_items(obj):
+    # リストの要素数 (dict の中のリスト・dict も数える。リストの要素の中までは見ない)
+    if isinstance(obj, list):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(_count_items(value) for value in obj.values() if isinstance(value, (list, dict)))
+    return 0
+
+
+def _iterencode(obj):
+    # リストは BATCH_ITEMS 件ずつ、dict は値ごとにエンコードする
+    # (dict の中のリスト・dict には入っていく。/dashboard の sections など)
+    if isinstance(obj, list) and obj:
+        # 要素ごとに encode を呼ぶと1回ごとの準備が重いので、BATCH_ITEMS 件ずつまとめる
+        separator = '['
+        for start in range(0, len(obj), BATCH_ITEMS):
+            yield separator
+            yield _encode(obj[start:start + BATCH_ITEMS])[1:-1]
+            separator = ', '
+        yield ']'
+    elif isinstance(obj, dict) and obj and all(isinstance(key, str) for key in obj):
+        separator = '{'
+        for key, value in obj.items():
+            yield separator
+            yield _encode(key)
+            yield ': '
+            if isinstance(value, (list, dict)):
+                yield from _iterencode(value)
+            else:
+                yield _encode(value)
+            separator = ', '
+        yield '}'
+    else:
+        yield _encode(obj)
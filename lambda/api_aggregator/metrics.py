@@ -0,0 +1,194 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# リクエストごとの処理時間・データ量を集計し、
+# CloudWatch Embedded Metric Format (EMF) のJSONとして標準出力に書き出すモジュール
+# (Lambdaの標準出力は CloudWatch Logs に送られ、EMF の行はメトリクスとして取り込まれる)
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'NewsHub')
+
+# 0 にするとメトリクスを出力しない (集計と debug=timing は動く)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# 上流のホストごとのメトリクスの Host ディメンションにするホスト (各モジュールが register_hosts で登録する)
+# /thumb は記事の画像のURLから任意のホストに取得しに行くので、登録されていないホストは OTHER_HOST にまとめる
+# (ディメンションの値ごとに CloudWatch のカスタムメトリクスが増えるため)
+OTHER_HOST = 'other'
+_known_hosts = set()
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    1リクエスト分の集計
+    並列取得のスレッドからも書き込まれるのでロックで守る
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.timings = {}    # 名前 -> 合計ミリ秒
+        self.counters = {}   # 名前 -> 合計
+        self.upstreams = {}  # ホスト -> {'requests', 'time_ms', 'bytes'}
+        self._lock = threading.Lock()
+
+    def add_timing(self, name, ms):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + ms
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_upstream(self, host, ms, size):
+        with self._lock:
+            stats = self.upstreams.get(host)
+            if stats is None:
+                stats = self.upstreams[host] = {'requests': 0, 'time_ms': 0.0, 'bytes': 0}
+            stats['requests'] += 1
+            stats['time_ms'] += ms
+            stats['bytes'] += size
+            self.timings['upstream'] = self.timings.get('upstream', 0.0) + ms
+            self.counters['bytes_downloaded'] = self.counters.get('bytes_downloaded', 0) + size
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """
+        Server-Timing ヘッダーの値 (debug=timing 用)
+        upstream は並列取得の合計なので total より長くなることがある
+        """
+        parts = [f"total;dur={self.elapsed_ms():.1f}"]
+        with self._lock:
+            for name, ms in sorted(self.timings.items()):
+                parts.append(f"{name};dur={ms:.1f}")
+            for host, stats in sorted(self.upstreams.items()):
+                parts.append(f'upstream-host;desc="{host}";dur={stats["time_ms"]:.1f}')
+        return ', '.join(parts)
+
+
+def start(route):
+    """
+    リクエストの集計を始める (現在のコンテキストに設定する)
+    """
+    metrics = RequestMetrics(route)
+    _current.set(metrics)
+    return metrics
+
+
+def current():
+    return _current.get()
+
+
+def add_timing(name, ms):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_timing(name, ms)
+
+
+def incr(name, value=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.incr(name, value)
+
+
+def add_upstream(host, ms, size):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_upstream(host, ms, size)
+
+
+@contextmanager
+def timer(name):
+    """
+    with の中の処理時間を name に加算する
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, (time.perf_counter() - started) * 1000)
+
+
+def register_hosts(*urls):
+    """
+    urls のホストを Host ディメンションに使うホストとして登録する
+    """
+    _known_hosts.update(urlsplit(url).hostname for url in urls)
+
+
+def emit(metrics, status_code):
+    """
+    集計結果を EMF のJSON行として出力する
+    リクエスト全体の1行と、上流のホストごとの1行を書く (登録されていないホストは OTHER_HOST の1行にまとめる)
+    """
+    if not METRICS_ENABLED:
+        return
+
+    timestamp = int(time.time() * 1000)
+    record = {
+        'Route': metrics.route,
+        'StatusCode': status_code,
+        'Latency': round(metrics.elapsed_ms(), 1),
+    }
+    definitions = [{'Name': 'Latency', 'Unit': 'Milliseconds'}]
+    with metrics._lock:
+        timings = dict(metrics.timings)
+        counters = dict(metrics.counters)
+        upstreams = {}
+        for host, stats in metrics.upstreams.items():
+            total = upstreams.setdefault(host if host in _known_hosts else OTHER_HOST,
+                                         {'requests': 0, 'time_ms': 0.0, 'bytes': 0})
+            for key in total:
+                total[key] += stats[key]
+
+    for name, ms in sorted(timings.items()):
+        key = _metric_name(name) + 'Time'
+        record[key] = round(ms, 1)
+        definitions.append({'Name': key, 'Unit': 'Milliseconds'})
+    for name, value in sorted(counters.items()):
+        key = _metric_name(name)
+        record[key] = value
+        definitions.append({'Name': key, 'Unit': 'Bytes' if name.endswith('bytes') or name.startswith('bytes') else 'Count'})
+
+    _write(timestamp, [['Route']], definitions, record)
+
+    for host, stats in sorted(upstreams.items()):
+        _write(timestamp, [['Host']], [
+            {'Name': 'UpstreamRequests', 'Unit': 'Count'},
+            {'Name': 'UpstreamTime', 'Unit': 'Milliseconds'},
+            {'Name': 'UpstreamBytes', 'Unit': 'Bytes'},
+        ], {
+            'Host': host,
+            'Route': metrics.route,
+            'UpstreamRequests': stats['requests'],
+            'UpstreamTime': round(stats['time_ms'], 1),
+            'UpstreamBytes': stats['bytes'],
+        })
+
+
+def _write(timestamp, dimensions, definitions, values):
+    document = {
+        '_aws': {
+            'Timestamp': timestamp,
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': dimensions,
+                'Metrics': definitions,
+            }]
+        },
+        **values
+    }
+    print(json.dumps(document, ensure_ascii=False), flush=True)
+
+
+def _metric_name(name):
+    # cache_hit -> CacheHit
+    return ''.join(part.capitalize() for part in name.split('_'))
@@ -1,9 +1,24 @@
-import feedparser
 from concurrent.futures import ThreadPoolExecutor
+import base64
+import calendar
+import hashlib
+import html
+import json
+import os
+import threading
 import time
 from datetime import datetime
 import re
 
+# 記事ストア (sqlite3)・画像プロキシ・XMLパーサー・スナップショット・取得間隔は
+# 使う関数の中で import する (ニュース以外のルートのコールドスタートで読み込まない)
+import compact
+import dedup
+import metrics
+import search
+import upstream
+from cache import TTLCache
+
 # RSS Feed URLs
 FEED_URLS = {
     'top': [
@@ -36,76 +51,399 @@ FEED_URLS = {
     ]
 }
 
+# 要約の最大文字数 (取り込み時にHTMLを除去して切り詰める)
+SUMMARY_MAX_LENGTH = int(os.environ.get('SUMMARY_MAX_LENGTH', '200'))
+
+# フィードのパーサー
+#   feedparser: feedparserでパース (既定)
+#   fast: fastfeedで1パスでパースする (不正なXMLはfeedparserにフォールバック)
+FEED_PARSER = os.environ.get('FEED_PARSER', 'feedparser')
+FEED_TIMEOUT = 5  # 秒
+
+# fetch_news 全体の締め切り (間に合わなかったフィードは裏で取得を続け、次回のキャッシュに載る)
+NEWS_DEADLINE = float(os.environ.get('NEWS_DEADLINE', '8'))
+
+# ページングの既定件数と上限
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+TAG_RE = re.compile(r'<[^>]+>')
+SPACE_RE = re.compile(r'\s+')
+
+# 取り込み処理のフィードの取得間隔の観測値 (polling.dump) を保存するスナップショットのキー
+SCHEDULE_KEY = 'news/schedule.json'
+
+# フィードURL -> カテゴリ (検索インデックス用)
+URL_CATEGORIES = {url: cat for cat, urls in FEED_URLS.items() for url in urls}
+metrics.register_hosts(*URL_CATEGORIES)
+
+# フィードキャッシュ設定
+# ウォームなLambdaコンテナでは前回の取得結果を再利用する
+# 上流から取得したフィードの有効期限は polling がフィードの更新頻度から決め、
+# FEED_CACHE_TTL は更新頻度がまだ分からないフィードとスナップショットから読んだフィードに使う
+FEED_CACHE_TTL = int(os.environ.get('FEED_CACHE_TTL', '600'))  # 秒
+FEED_CACHE_MAX_ENTRIES = int(os.environ.get('FEED_CACHE_MAX_ENTRIES', '64'))
+
+_feed_cache = TTLCache(ttl=FEED_CACHE_TTL, maxsize=FEED_CACHE_MAX_ENTRIES)
+
+# 期限切れフィードの裏更新用 (リクエストを跨いで使い回す)
+# Lambdaではレスポンス返却後にコンテナが凍結されるため、
+# 更新は次の呼び出しで再開されることもある
+_refresh_executor = ThreadPoolExecutor(max_workers=4)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# フィードごとの取得統計 (キャッシュヒット / 304 / 200)
+_feed_stats = {}
+_feed_stats_lock = threading.Lock()
+
 def parse_feed(url):
     """
     RSSフィードをパースして標準形式のリストを返す
     """
     try:
-        feed = feedparser.parse(url)
-        entries = []
-        for entry in feed.entries:
-            # 公開日時の正規化
-            published = None
-            if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                published = entry.published_parsed
-            elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
-                published = entry.updated_parsed
-
-            pub_date = ""
-            timestamp = 0
-            if published:
-                timestamp = time.mktime(published)
-                pub_date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
-            # 画像の抽出 (feedparserが取得できた場合)
-            image_url = None
-            if hasattr(entry, 'links'):
-                for link in entry.links:
-                    if link.get('type', '').startswith('image/'):
-                        image_url = link.get('href')
-                        break
-
-            # Media RSSのサムネイル対応 (media_content, media_thumbnail)
-            if not image_url and hasattr(entry, 'media_content'):
-                for media in entry.media_content:
-                    if media.get('medium') == 'image':
-                        image_url = media.get('url')
-                        break
-            if not image_url and hasattr(entry, 'media_thumbnail'):
-                if len(entry.media_thumbnail) > 0:
-                    image_url = entry.media_thumbnail[0].get('url')
-
-            # 説明文(summary/description/content)から画像を抽出
-            if not image_url:
-                content_to_search = getattr(entry, 'summary', '') or getattr(entry, 'description', '')
-                if hasattr(entry, 'content'):
-                    for c in entry.content:
-                        content_to_search += c.get('value', '')
-
-                # <img src="..."> を検索
-                img_match = re.search(r'<img[^>]+src=["\'](.*?)["\']', content_to_search, re.IGNORECASE)
-                if img_match:
-                    image_url = img_match.group(1)
-
-            entries.append({
-                'title': entry.title,
-                'link': entry.link,
-                'published': pub_date,
-                'timestamp': timestamp,
-                'summary': getattr(entry, 'summary', ''),
-                'source': feed.feed.get('title', ''),
-                'image': image_url
-            })
-        return entries
+        return _load_feed(url)['entries']
+    except Exception as e:
+        print(f"Error parsing {url}: {e}")
+        return []
+
+def _load_feed(url, etag=None, modified=None):
+    """
+    RSSフィードを取得・パースする (失敗時は例外を送出)
+    etag/modified を渡すと条件付きリクエストになり、
+    更新がない(304)場合は None を返す
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    response = upstream.get(url, headers=headers, timeout=FEED_TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    return {
+        'entries': _parse_body(response),
+        'etag': response.headers.get('ETag'),
+        'modified': response.headers.get('Last-Modified')
+    }
+
+def _parse_body(response):
+    import thumbs
+
+    with metrics.timer('parse'):
+        entries = _parse_response(response)
+    # 記事の画像は縮小プロキシ (/thumb) 経由で表示する
+    return thumbs.rewrite_images(entries)
+
+def _parse_response(response):
+    if FEED_PARSER == 'fast':
+        import xml.etree.ElementTree as ET
+
+        import fastfeed
+
+        try:
+            _, entries = fastfeed.parse(response.content)
+        except ET.ParseError:
+            # 厳密なXMLとして読めないフィードはfeedparserに任せる
+            pass
+        else:
+            for entry in entries:
+                entry['summary'] = clean_summary(entry['summary'])
+            return entries
+
+    # feedparser は読み込みが重いので、使うときに import する
+    import feedparser
+
+    feed = feedparser.parse(response.content, response_headers=dict(response.headers))
+    if feed.get('bozo') and not feed.entries:
+        raise feed.get('bozo_exception') or ValueError('Invalid feed')
+    return _parse_entries(feed)
+
+def _parse_entries(feed):
+    """
+    feedparserの結果を標準形式のリストに変換する
+    """
+    entries = []
+    for entry in feed.entries:
+        # 公開日時の正規化
+        published = None
+        if hasattr(entry, 'published_parsed') and entry.published_parsed:
+            published = entry.published_parsed
+        elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
+            published = entry.updated_parsed
+
+        pub_date = ""
+        timestamp = 0
+        if published:
+            # feedparser の *_parsed は UTC (fastfeed と同じく UNIX時刻にする。time.mktime は地方時として解釈してしまう)
+            timestamp = float(calendar.timegm(published))
+            pub_date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+        # 画像の抽出 (feedparserが取得できた場合)
+        image_url = None
+        if hasattr(entry, 'links'):
+            for link in entry.links:
+                if link.get('type', '').startswith('image/'):
+                    image_url = link.get('href')
+                    break
+
+        # Media RSSのサムネイル対応 (media_content, media_thumbnail)
+        if not image_url and hasattr(entry, 'media_content'):
+            for media in entry.media_content:
+                if media.get('medium') == 'image':
+                    image_url = media.get('url')
+                    break
+        if not image_url and hasattr(entry, 'media_thumbnail'):
+            if len(entry.media_thumbnail) > 0:
+                image_url = entry.media_thumbnail[0].get('url')
+
+        # 説明文(summary/description/content)から画像を抽出
+        if not image_url:
+            content_to_search = getattr(entry, 'summary', '') or getattr(entry, 'description', '')
+            if hasattr(entry, 'content'):
+                for c in entry.content:
+                    content_to_search += c.get('value', '')
+
+            # <img src="..."> を検索
+            img_match = re.search(r'<img[^>]+src=["\'](.*?)["\']', content_to_search, re.IGNORECASE)
+            if img_match:
+                image_url = img_match.group(1)
+
+        entries.append({
+            'title': entry.title,
+            'link': entry.link,
+            'published': pub_date,
+            'timestamp': timestamp,
+            'summary': clean_summary(getattr(entry, 'summary', '')),
+            'source': feed.feed.get('title', ''),
+            'image': image_url
+        })
+    return entries
+
+def clean_summary(summary):
+    """
+    要約からHTMLタグを除去し、空白を詰めて一定の長さに切り詰める
+    フロントエンドは要約をHTMLとして挿入するので、最後にエスケープし直す
+    (&lt;img ...&gt; のようにエスケープされたタグを、実体参照を戻したあとでタグとして解釈させない)
+    """
+    text = SPACE_RE.sub(' ', html.unescape(TAG_RE.sub(' ', summary or ''))).strip()
+    if len(text) > SUMMARY_MAX_LENGTH:
+        text = text[:SUMMARY_MAX_LENGTH].rstrip() + '…'
+    return html.escape(text, quote=False)
+
+def get_feed(url):
+    """
+    キャッシュ経由でフィードのエントリーを取得する
+    期限切れの場合はキャッシュ済みの値をそのまま返し、裏で更新する
+    """
+    cached, fresh = _feed_cache.get(url)
+    if cached is None:
+        # 初回は同期的に取得
+        return refresh_feed(url)
+    _count(url, 'hit' if fresh else 'stale')
+    if not fresh:
+        _schedule_refresh(url)
+    return cached['entries']
+
+def refresh_feed(url, use_snapshot=None):
+    """
+    フィードを取得し直してキャッシュを更新する
+    スナップショットストアが設定されている場合は、上流ではなく
+    取り込み処理 (ingest.py) が保存したスナップショットから読む
+    """
+    import polling
+    import snapshots
+
+    if use_snapshot is None:
+        use_snapshot = snapshots.enabled()
+    if use_snapshot:
+        # 更新の少ないフィードは取り込み処理でも POLL_MAX_INTERVAL ごとにしか取得しないので、その分は古くてもよい
+        record = snapshots.read(snapshot_key(url), max_age=polling.POLL_MAX_INTERVAL + snapshots.SNAPSHOT_MAX_AGE)
+        if record is not None:
+            _count(url, 'snapshot')
+            return _store_record(url, record)
+        # まだ取り込まれていないフィードは直接取得する
+
+    return _refresh_from_upstream(url)
+
+def _refresh_from_upstream(url, store_articles=True):
+    """
+    上流からフィードを取得する
+    前回のETag/Last-Modifiedがあれば条件付きリクエストを送り、
+    304の場合はキャッシュ済みのエントリーを再利用する
+    取得に失敗した場合は古いキャッシュを残す
+    store_articles=False の場合は記事ストアに蓄積しない (取り込み処理用)
+    """
+    import polling
+
+    cached, _ = _feed_cache.get(url)
+    etag = cached.get('etag') if cached else None
+    modified = cached.get('modified') if cached else None
+    schedule = polling.feed(url)
+
+    started = time.monotonic()
+    try:
+        loaded = _load_feed(url, etag=etag, modified=modified)
+    except upstream.CircuitOpen:
+        # ホストが落ちている間は問い合わせず、最後に取得できたエントリーを返す
+        _count(url, 'circuit_open')
+        return _keep_cached(url, cached)
     except Exception as e:
         print(f"Error parsing {url}: {e}")
+        _count(url, 'error')
+        schedule.record_failure(time.monotonic() - started)
+        return _keep_cached(url, cached)
+
+    if loaded is None:
+        _count(url, 'not_modified')
+        schedule.record_not_modified(time.monotonic() - started)
+        _feed_cache.set(url, cached, ttl=schedule.interval())
+        return cached['entries']
+
+    _count(url, 'fetched')
+    schedule.record_success([entry['timestamp'] for entry in loaded['entries']], time.monotonic() - started)
+    return _store_record(url, loaded, ttl=schedule.interval(), store_articles=store_articles)
+
+def _keep_cached(url, cached):
+    """
+    取得に失敗したときは前回のエントリーを返す
+    次の取得はバックオフした間隔の後にする (リクエストのたびに取得し直さない)
+    """
+    import polling
+
+    if not cached:
         return []
+    _feed_cache.set(url, cached, ttl=polling.interval(url))
+    return cached['entries']
+
+def _store_record(url, record, ttl=None, store_articles=True):
+    """
+    取得したフィードをキャッシュ・検索インデックス・記事ストアに入れ、キャッシュしたエントリーを返す
+    キャッシュには省メモリの Entry にして持つ
+    """
+    record = dict(record, entries=compact.compact(record['entries']))
+    _feed_cache.set(url, record, ttl=ttl)
+    # 新しく取得した記事を検索インデックスに追加
+    search.index.add(record['entries'], category=URL_CATEGORIES.get(url))
+    # 近似重複の判定に使う値を先に計算しておく
+    dedup.prepare(record['entries'])
+    # 記事ストアに蓄積 (失敗してもニュースの取得は続ける)
+    if store_articles:
+        import articles
+
+        try:
+            articles.upsert(record['entries'], category=URL_CATEGORIES.get(url))
+        except Exception as e:
+            print(f"Error storing articles for {url}: {e}")
+    return record['entries']
+
+def get_schedule():
+    """
+    フィードごとの取得間隔と観測値
+    スナップショットを使う場合、上流から取得するのは取り込み処理なので、取り込み処理が保存したものを返す
+    """
+    import polling
+    import snapshots
+
+    if snapshots.enabled():
+        polling.load(snapshots.read(SCHEDULE_KEY, max_age=None))
+    return polling.get_schedule()
+
+def snapshot_key(url):
+    """
+    フィードURLに対応するスナップショットのキー
+    """
+    return f"news/feeds/{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+def ingest_feed(url):
+    """
+    上流からフィードを取得してスナップショットとして保存する (取り込み処理用)
+    前回のスナップショットのETag/Last-Modifiedを引き継いで条件付きリクエストにする
+    """
+    import snapshots
+
+    cached, _ = _feed_cache.get(url)
+    if cached is None:
+        # ETag/Last-Modified を引き継ぐだけなので古くてもよい
+        previous = snapshots.read(snapshot_key(url), max_age=None)
+        if previous is not None:
+            _feed_cache.set(url, previous)
+
+    # 記事ストアは API のコンテナの /tmp にあるので、ここでは書かない (API がスナップショットを読んだときに蓄積する)
+    entries = _refresh_from_upstream(url, store_articles=False)
+    record, _ = _feed_cache.get(url)
+    if record is not None:
+        snapshots.write(snapshot_key(url), {
+            'url': url,
+            'entries': compact.to_dicts(record['entries']),
+            'etag': record.get('etag'),
+            'modified': record.get('modified')
+        })
+    return entries
+
+def _count(url, key):
+    metrics.incr(f'feed_{key}')
+    with _feed_stats_lock:
+        stats = _feed_stats.get(url)
+        if stats is None:
+            stats = _feed_stats[url] = {
+                'hit': 0, 'stale': 0, 'snapshot': 0, 'not_modified': 0, 'fetched': 0, 'error': 0,
+                'circuit_open': 0
+            }
+        stats[key] += 1
+
+def cache_max_age(category=None, keyword=None):
+    """
+    ニュースのレスポンスをキャッシュしてよい秒数 (対象のフィードのうち最も短い取得間隔)
+    更新の少ないフィードでも FEED_CACHE_TTL より長くはしない
+    (取得間隔が延びるのはサーバー側の取得だけで、ブラウザ・CloudFrontからはこれまで通り問い合わせる)
+    """
+    if keyword and category not in FEED_URLS:
+        urls = list(URL_CATEGORIES)
+    else:
+        urls = FEED_URLS.get(category) or FEED_URLS['top']
+    import polling
+    import snapshots
+
+    if snapshots.enabled():
+        return FEED_CACHE_TTL
+    return min([FEED_CACHE_TTL] + [polling.interval(url) for url in urls])
+
+def get_feed_stats():
+    """
+    フィードごとのキャッシュ利用状況を返す
+    hit: 有効なキャッシュから返却 / stale: 期限切れキャッシュを返却して裏で更新
+    snapshot: スナップショットから読み込み
+    not_modified: 304で本文を再取得せずに済んだ / fetched: 200で本文を取得 / error: 取得失敗
+    """
+    with _feed_stats_lock:
+        return {url: dict(stats) for url, stats in _feed_stats.items()}
 
-def fetch_news(category=None, keyword=None):
+def _schedule_refresh(url):
+    with _refreshing_lock:
+        if url in _refreshing:
+            return
+        _refreshing.add(url)
+
+    def run():
+        try:
+            refresh_feed(url)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(url)
+
+    _refresh_executor.submit(run)
+
+def fetch_news(category=None, keyword=None, offset=0, limit=None, since=None):
     """
     ニュースを取得するメイン関数
     category: 指定されたカテゴリのニュースを取得
-    keyword: キーワードでフィルタリング (指定された場合は全カテゴリまたは指定カテゴリから検索)
+    keyword: キーワードで検索 (指定された場合は全カテゴリまたは指定カテゴリから検索)
+    offset/limit: キーワード検索結果のページング
+    since: この時刻 (UNIX秒) より新しい記事だけを返す
+           (記事ストアから引くので、フィードから消えた記事も含まれる)
     """
     urls = []
 
@@ -120,24 +458,114 @@ def fetch_news(category=None, keyword=None):
     else:
         urls = FEED_URLS['top']
 
-    # 並列処理でフィード取得
+    # 並列処理でフィード取得 (取得した記事は検索インデックスにも反映される)
+    deadline = upstream.deadline_after(NEWS_DEADLINE)
+    results = upstream.run_all({url: (lambda url=url: get_feed(url)) for url in urls}, deadline=deadline)
     all_entries = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        results = executor.map(parse_feed, urls)
-        for res in results:
-            all_entries.extend(res)
-
-    # 日付順にソート (新しい順)
-    all_entries.sort(key=lambda x: x['timestamp'], reverse=True)
+    for url, res in results.items():
+        if isinstance(res, Exception):
+            print(f"Skipping {url}: {res!r}")
+            continue
+        all_entries.extend(res)
 
-    # キーワードフィルタリング
+    # キーワード検索はインデックスから引く (一致度 + 新しさ順)
     if keyword:
-        keyword = keyword.lower()
-        all_entries = [
-            e for e in all_entries
-            if keyword in e['title'].lower() or keyword in e['summary'].lower()
-        ]
+        search_category = category if category in FEED_URLS else None
+        results = dedup.cluster(search.index.search(keyword, category=search_category))
+        end = offset + limit if limit is not None else None
+        return results[offset:end]
+
+    if since is not None:
+        import articles
+
+        since = float(since)
+        if articles.enabled():
+            try:
+                store_category = category if category in FEED_URLS else 'top'
+                return dedup.cluster(articles.since(since, category=store_category))
+            except Exception as e:
+                print(f"Error reading articles: {e}")
+        # ストアが使えない場合は今のフィードの中から絞り込む
+        all_entries = [entry for entry in all_entries if entry['timestamp'] > since]
+
+    # 日付順にソート (新しい順、同時刻はリンク順でページングのカーソルを安定させる)
+    all_entries.sort(key=lambda x: (x['timestamp'], x['link']), reverse=True)
+
+    # 複数フィードに載った同じ記事・同じ話題をまとめる
+    # (カテゴリの一覧はフィードが更新されるまで前回の結果を使う)
+    cluster_key = (category if category in FEED_URLS else 'top') if since is None else None
+    all_entries = dedup.cluster(all_entries, key=cluster_key)
 
     # 必要のないフィールド（timestamp）を削除して返しても良いが、
     # フロントエンドでのソート等に使うかもしれないので残す
     return all_entries
+
+def paginate(entries, limit=None, cursor=None):
+    """
+    fetch_news の結果 (新しい順) をカーソルでページングする
+    (items, next_cursor) を返す。次のページがない場合 next_cursor は None
+    """
+    limit = parse_limit(limit) or DEFAULT_PAGE_SIZE
+
+    start = 0
+    if cursor:
+        position = _decode_cursor(cursor)
+        # カーソルより古い最初の記事から始める
+        while start < len(entries) and (entries[start]['timestamp'], entries[start]['link']) >= position:
+            start += 1
+
+    items = entries[start:start + limit]
+    next_cursor = None
+    if start + limit < len(entries) and items:
+        last = items[-1]
+        next_cursor = _encode_cursor(last['timestamp'], last['link'])
+    return items, next_cursor
+
+def parse_limit(value):
+    """
+    クエリパラメータの limit (1〜MAX_PAGE_SIZE)。未指定ならNone、不正な値は ValueError
+    """
+    if not value:
+        return None
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid limit")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError("Invalid limit")
+    return limit
+
+def parse_offset(value):
+    """
+    クエリパラメータの offset (0以上)。未指定なら0、不正な値は ValueError
+    """
+    if not value:
+        return 0
+    try:
+        offset = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid offset")
+    if offset < 0:
+        raise ValueError("Invalid offset")
+    return offset
+
+def project(entries, fields=None):
+    """
+    fields (カンマ区切り) で指定されたフィールドだけを残す
+    """
+    if not fields:
+        return entries
+    names = [f.strip() for f in fields.split(',') if f.strip()]
+    return [{name: e[name] for name in names if name in e} for e in entries]
+
+def _encode_cursor(timestamp, link):
+    raw = json.dumps([timestamp, link], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, link = json.loads(raw)
+        return float(timestamp), str(link)
+    except Exception:
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+
+# フィードごとの取得間隔を決めるスケジューラー
+# 記事の timestamp から更新の間隔 (cadence) を推定し、更新の少ないフィードは間隔を空けて取得する
+# 取得に失敗したフィードは間隔を倍々に空ける (バックオフ)
+#
+# 決めた間隔は、フィードのキャッシュ (news._feed_cache) の有効期限と
+# 取り込み処理 (ingest.py) で取得するフィードの選択に使う
+
+# 取得間隔の下限・上限 (秒)
+POLL_MIN_INTERVAL = int(os.environ.get('POLL_MIN_INTERVAL', '120'))
+POLL_MAX_INTERVAL = int(os.environ.get('POLL_MAX_INTERVAL', str(3 * 3600)))
+
+# まだ更新の間隔が分からないフィードの取得間隔 (秒)
+POLL_DEFAULT_INTERVAL = int(os.environ.get('FEED_CACHE_TTL', '600'))
+
+# 更新の間隔に対する取得間隔の割合 (0.5 なら更新1回あたり2回取得する)
+POLL_CADENCE_FACTOR = float(os.environ.get('POLL_CADENCE_FACTOR', '0.5'))
+
+# 指数移動平均 (EWMA) の重み (新しい観測値の割合)
+EWMA_ALPHA = 0.3
+
+# 失敗したときの取得間隔: POLL_BACKOFF_BASE x 2^(連続失敗数 - 1) (POLL_MAX_BACKOFF まで)
+POLL_BACKOFF_BASE = int(os.environ.get('POLL_BACKOFF_BASE', '60'))
+POLL_MAX_BACKOFF = int(os.environ.get('POLL_MAX_BACKOFF', '1800'))
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+class FeedSchedule:
+    """
+    1フィード分の観測値 (更新の間隔・応答時間・エラー率) と次の取得時刻
+    時刻はスナップショットに保存して取り込み処理の間で引き継ぐので time.time() を使う
+    """
+
+    FIELDS = ('cadence', 'latency', 'error_rate', 'failures', 'newest', 'last_poll', 'polls')
+
+    def __init__(self):
+        self.cadence = None     # 記事が公開される平均間隔 (秒)
+        self.latency = None     # 応答時間の EWMA (秒)
+        self.error_rate = 0.0   # 失敗の EWMA (0〜1)
+        self.failures = 0       # 連続失敗数
+        self.newest = 0         # これまでに見た最も新しい記事の timestamp
+        self.last_poll = None   # 最後に取得した時刻
+        self.polls = 0
+        self._lock = threading.Lock()
+
+    def record_success(self, timestamps, latency, now=None):
+        """
+        取得に成功した (timestamps はフィードに載っている記事の timestamp)
+        """
+        now = now or time.time()
+        timestamps = sorted(t for t in timestamps if t and t <= now)
+        with self._lock:
+            self._record_poll(latency, False, now)
+            if not timestamps:
+                return
+            if not self.newest:
+                # 初回はフィードに載っている記事の間隔から推定する
+                if len(timestamps) >= 2:
+                    self.cadence = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
+            else:
+                new = [t for t in timestamps if t > self.newest]
+                if new:
+                    # 前回までの最新の記事から、新しい記事1件あたりの間隔
+                    self._observe((new[-1] - self.newest) / len(new))
+            self.newest = max(self.newest, timestamps[-1])
+            self._observe_quiet(now)
+
+    def record_not_modified(self, latency, now=None):
+        """
+        304 が返った (新しい記事はない)
+        """
+        now = now or time.time()
+        with self._lock:
+            self._record_poll(latency, False, now)
+            self._observe_quiet(now)
+
+    def record_failure(self, latency, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._record_poll(latency, True, now)
+
+    def interval(self):
+        """
+        次に取得するまでの間隔 (秒)
+        """
+        with self._lock:
+            if self.failures:
+                return min(POLL_MAX_BACKOFF, POLL_BACKOFF_BASE * 2 ** (self.failures - 1))
+            if self.cadence is None:
+                return POLL_DEFAULT_INTERVAL
+            return min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, self.cadence * POLL_CADENCE_FACTOR))
+
+    def next_poll(self):
+        if self.last_poll is None:
+            return 0.0
+        return self.last_poll + self.interval()
+
+    def stats(self):
+        interval = self.interval()
+        with self._lock:
+            return {
+                'cadence_sec': round(self.cadence, 1) if self.cadence is not None else None,
+                'interval_sec': round(interval, 1),
+                'next_poll': round(self.last_poll + interval, 3) if self.last_poll is not None else None,
+                'last_poll': self.last_poll,
+                'newest': self.newest or None,
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                'error_rate': round(self.error_rate, 3),
+                'failures': self.failures,
+                'polls': self.polls,
+            }
+
+    def dump(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in self.FIELDS}
+
+    def load(self, state):
+        with self._lock:
+            for name in self.FIELDS:
+                if name in state:
+                    setattr(self, name, state[name])
+
+    def _record_poll(self, latency, failed, now):
+        self.polls += 1
+        self.last_poll = now
+        self.failures = self.failures + 1 if failed else 0
+        self.error_rate += EWMA_ALPHA * ((1.0 if failed else 0.0) - self.error_rate)
+        if latency is not None and not failed:
+            self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+
+    def _observe(self, gap):
+        gap = max(gap, 0.0)
+        self.cadence = gap if self.cadence is None else self.cadence + EWMA_ALPHA * (gap - self.cadence)
+
+    def _observe_quiet(self, now):
+        # 最新の記事から推定した間隔以上に新しい記事がなければ、更新の間隔は少なくともそれだけある
+        if self.newest and self.cadence is not None:
+            quiet = now - self.newest
+            if quiet > self.cadence:
+                self._observe(quiet)
+
+
+def feed(url):
+    with _feeds_lock:
+        schedule = _feeds.get(url)
+        if schedule is None:
+            schedule = _feeds[url] = FeedSchedule()
+        return schedule
+
+
+def interval(url):
+    return feed(url).interval()
+
+
+def due(url, now=None):
+    """
+    取得する時刻になっているか
+    """
+    return feed(url).next_poll() <= (now or time.time())
+
+
+def get_schedule():
+    """
+    フィードごとの取得間隔・次の取得時刻・観測値 (次の取得が早い順)
+    """
+    with _feeds_lock:
+        feeds = dict(_feeds)
+    schedule = {url: schedule.stats() for url, schedule in feeds.items()}
+    return dict(sorted(schedule.items(), key=lambda item: item[1]['next_poll'] or 0))
+
+
+def dump():
+    with _feeds_lock:
+        feeds = dict(_feeds)
+    return {url: schedule.dump() for url, schedule in feeds.items()}
+
+
+def load(state):
+    """
+    dump() で保存した観測値を読み込む (取り込み処理の間で引き継ぐ)
+    """
+    for url, feed_state in (state or {}).items():
+        feed(url).load(feed_state)
@@ -0,0 +1,50 @@
+# 都道府県庁所在地の座標 (frontend/js/prefectures.js と同じ値)
+PREFECTURES = [
+    {"name": "北海道", "lat": 43.0642, "lon": 141.3469},
+    {"name": "青森県", "lat": 40.8244, "lon": 140.74},
+    {"name": "岩手県", "lat": 39.7020, "lon": 141.1544},
+    {"name": "宮城県", "lat": 38.2688, "lon": 140.8721},
+    {"name": "秋田県", "lat": 39.7186, "lon": 140.1023},
+    {"name": "山形県", "lat": 38.2404, "lon": 140.3636},
+    {"name": "福島県", "lat": 37.7502, "lon": 140.4675},
+    {"name": "茨城県", "lat": 36.3418, "lon": 140.4468},
+    {"name": "栃木県", "lat": 36.5657, "lon": 139.8835},
+    {"name": "群馬県", "lat": 36.3906, "lon": 139.0604},
+    {"name": "埼玉県", "lat": 35.8574, "lon": 139.6489},
+    {"name": "千葉県", "lat": 35.6050, "lon": 140.1234},
+    {"name": "東京都", "lat": 35.6895, "lon": 139.6917},
+    {"name": "神奈川県", "lat": 35.4477, "lon": 139.6425},
+    {"name": "新潟県", "lat": 37.9024, "lon": 139.0232},
+    {"name": "富山県", "lat": 36.6952, "lon": 137.2113},
+    {"name": "石川県", "lat": 36.5946, "lon": 136.6255},
+    {"name": "福井県", "lat": 36.0652, "lon": 136.2216},
+    {"name": "山梨県", "lat": 35.6641, "lon": 138.5684},
+    {"name": "長野県", "lat": 36.6512, "lon": 138.1812},
+    {"name": "岐阜県", "lat": 35.3912, "lon": 136.7222},
+    {"name": "静岡県", "lat": 34.9751, "lon": 138.3832},
+    {"name": "愛知県", "lat": 35.1802, "lon": 136.9066},
+    {"name": "三重県", "lat": 34.7302, "lon": 136.5086},
+    {"name": "滋賀県", "lat": 35.0045, "lon": 135.8685},
+    {"name": "京都府", "lat": 35.0210, "lon": 135.7556},
+    {"name": "大阪府", "lat": 34.6863, "lon": 135.5199},
+    {"name": "兵庫県", "lat": 34.6912, "lon": 135.1830},
+    {"name": "奈良県", "lat": 34.6853, "lon": 135.8327},
+    {"name": "和歌山県", "lat": 34.2260, "lon": 135.1675},
+    {"name": "鳥取県", "lat": 35.5038, "lon": 134.2376},
+    {"name": "島根県", "lat": 35.4722, "lon": 133.0505},
+    {"name": "岡山県", "lat": 34.6617, "lon": 133.9349},
+    {"name": "広島県", "lat": 34.3965, "lon": 132.4596},
+    {"name": "山口県", "lat": 34.1858, "lon": 131.4714},
+    {"name": "徳島県", "lat": 34.0657, "lon": 134.5593},
+    {"name": "香川県", "lat": 34.3401, "lon": 134.0433},
+    {"name": "愛媛県", "lat": 33.8416, "lon": 132.7656},
+    {"name": "高知県", "lat": 33.5597, "lon": 133.5310},
+    {"name": "福岡県", "lat": 33.6067, "lon": 130.4183},
+    {"name": "佐賀県", "lat": 33.2494, "lon": 130.2988},
+    {"name": "長崎県", "lat": 32.7448, "lon": 129.8737},
+    {"name": "熊本県", "lat": 32.7898, "lon": 130.7416},
+    {"name": "大分県", "lat": 33.2381, "lon": 131.6125},
+    {"name": "宮崎県", "lat": 31.9110, "lon": 131.4238},
+    {"name": "鹿児島県", "lat": 31.5601, "lon": 130.5571},
+    {"name": "沖縄県", "lat": 26.2123, "lon": 127.6791}
+]
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import zlib
+
+import jsonstream
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    # brotli はオプション (Lambdaのパッケージに含めた場合だけ使う)
+    brotli = None
+
+# これより小さいボディは圧縮しない (バイト)
+COMPRESS_MIN_SIZE = 1024
+
+# 対応している Content-Encoding (優先順)
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Accept-Encoding ヘッダーから使う Content-Encoding を選ぶ
+    対応するものがなければ None (無圧縮)
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+
+    best = None
+    for encoding in SUPPORTED_ENCODINGS:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def compressor(encoding):
+    """
+    チャンクごとに圧縮するオブジェクト (compress(data) と flush() を持つ)
+    """
+    if encoding == 'br':
+        return _BrotliCompressor()
+    # wbits=31 で gzip 形式 (ヘッダーの mtime は 0)
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def make_etag(digest, encoding=None):
+    # 圧縮した表現は別のバイト列なので、強いETagはエンコーディングごとに分ける
+    if encoding:
+        return f'"{digest}-{encoding}"'
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, digest):
+    """
+    If-None-Match のいずれかが同じ内容 (エンコーディングは問わない) を指していれば True
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        for encoding in ('br', 'gzip'):
+            if tag.endswith(f'-{encoding}'):
+                tag = tag[:-len(encoding) - 1]
+                break
+        if tag == digest:
+            return True
+    return False
+
+
+def build_json(status_code, headers, body, request_headers):
+    """
+    ボディ (JSONにできる値) から API Gateway 向けのレスポンスを組み立てる
+    ETag (無圧縮のボディのハッシュ) と If-None-Match が一致すれば 304、クライアントが対応していれば圧縮する
+    JSONの文字列全体を作らず、チャンクごとにハッシュの計算と圧縮をする
+    (圧縮しない場合だけチャンクをつないで文字列にする)
+    """
+    encoding = negotiate_encoding(request_headers.get('accept-encoding'))
+    digest = hashlib.sha256()
+    size = 0
+    pending = []      # 圧縮を始めるまでのチャンク (小さいボディは圧縮しないため)
+    compressed = None
+    stream = None
+
+    for chunk in jsonstream.iterencode(body):
+        data = chunk.encode('utf-8')
+        digest.update(data)
+        size += len(data)
+        if stream is not None:
+            compressed.append(stream.compress(data))
+            continue
+        pending.append(data)
+        if encoding and size >= COMPRESS_MIN_SIZE:
+            stream = compressor(encoding)
+            compressed = [stream.compress(part) for part in pending]
+            pending = None
+
+    metrics.incr('body_bytes', size)
+    digest = digest.hexdigest()[:32]
+    headers = dict(headers)
+    headers['ETag'] = make_etag(digest, encoding if stream is not None else None)
+    headers['Vary'] = 'Accept-Encoding'
+
+    if status_code == 200 and etag_matches(request_headers.get('if-none-match'), digest):
+        return {
+            'statusCode': 304,
+            'headers': headers,
+            'body': ''
+        }
+
+    if stream is None:
+        return {
+            'statusCode': status_code,
+            'headers': headers,
+            'body': b''.join(pending).decode('utf-8')
+        }
+
+    compressed.append(stream.flush())
+    compressed = b''.join(compressed)
+    headers['Content-Encoding'] = encoding
+    metrics.incr('compressed_bytes', len(compressed))
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def build_binary(headers, body, digest, request_headers):
+    """
+    画像などのバイナリのボディから API Gateway 向けのレスポンスを組み立てる
+    (すでに圧縮された形式なので Content-Encoding は付けない)
+    """
+    headers = dict(headers)
+    headers['ETag'] = make_etag(digest)
+
+    if etag_matches(request_headers.get('if-none-match'), digest):
+        return {
+            'statusCode': 304,
+            'headers': headers,
+            'body': ''
+        }
+
+    metrics.incr('body_bytes', len(body))
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True
+    }
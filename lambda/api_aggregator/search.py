@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+import time
+import unicodedata
+
+# インデックスに保持する記事数の上限 (超えた分は古い記事から削除)
+SEARCH_INDEX_MAX_DOCS = int(os.environ.get('SEARCH_INDEX_MAX_DOCS', '5000'))
+
+# スコアの重み
+TITLE_WEIGHT = 3
+SUMMARY_WEIGHT = 1
+RECENCY_WEIGHT = 2.0
+RECENCY_HALF_LIFE_HOURS = 24
+
+
+def normalize(text):
+    """
+    検索用に文字列を正規化する (全角英数→半角、小文字化)
+    """
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def bigrams(text):
+    """
+    正規化済み文字列を文字bigramに分割する
+    日本語は単語の区切りがないため、形態素解析の代わりにbigramを使う
+    空白をまたぐbigramは作らない
+    """
+    grams = set()
+    for chunk in text.split():
+        for i in range(len(chunk) - 1):
+            grams.add(chunk[i:i + 2])
+    return grams
+
+
+class SearchIndex:
+    """
+    ニュース記事の転置インデックス
+    フィード取得のたびに add() で差分を追加していく
+    """
+
+    def __init__(self, max_docs=SEARCH_INDEX_MAX_DOCS):
+        self.max_docs = max_docs
+        self._docs = {}        # doc_id -> (entry, categories, title, summary)
+        self._by_link = {}     # link -> doc_id
+        self._postings = {}    # bigram -> set(doc_id)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, entries, category=None):
+        """
+        記事を追加する。同じリンクの記事は内容が変わっていれば置き換える
+        複数カテゴリのフィードに載っている記事はどのカテゴリからも検索できる
+        """
+        with self._lock:
+            for entry in entries:
+                link = entry.get('link')
+                if not link:
+                    continue
+                title = normalize(entry.get('title'))
+                summary = normalize(entry.get('summary'))
+
+                categories = {category} if category else set()
+                doc_id = self._by_link.get(link)
+                if doc_id is not None:
+                    _, old_categories, old_title, old_summary = self._docs[doc_id]
+                    categories |= old_categories
+                    if old_title == title and old_summary == summary:
+                        self._docs[doc_id] = (entry, categories, title, summary)
+                        continue
+                    self._remove(doc_id)
+
+                doc_id = self._next_id
+                self._next_id += 1
+                self._docs[doc_id] = (entry, categories, title, summary)
+                self._by_link[link] = doc_id
+                for gram in bigrams(title) | bigrams(summary):
+                    self._postings.setdefault(gram, set()).add(doc_id)
+
+            if len(self._docs) > self.max_docs:
+                self._evict()
+
+    def search(self, query, category=None, offset=0, limit=None):
+        """
+        クエリに一致する記事を返す
+        空白区切りの複数語はAND検索。一致度と新しさでスコアを付けて並べる
+        """
+        terms = [t for t in normalize(query).split() if t]
+        if not terms:
+            return []
+
+        with self._lock:
+            candidates = None
+            for term in terms:
+                # 1文字の語はbigramで絞り込めないので全件から照合する
+                if len(term) < 2:
+                    continue
+                for gram in bigrams(term):
+                    posting = self._postings.get(gram, set())
+                    candidates = posting.copy() if candidates is None else candidates & posting
+                    if not candidates:
+                        return []
+            if candidates is None:
+                candidates = self._docs.keys()
+
+            now = time.time()
+            scored = []
+            for doc_id in candidates:
+                entry, categories, title, summary = self._docs[doc_id]
+                if category and category not in categories:
+                    continue
+
+                # bigramの一致だけでは連続しているとは限らないので部分一致で確認する
+                score = 0
+                for term in terms:
+                    title_hits = title.count(term)
+                    summary_hits = summary.count(term)
+                    if not title_hits and not summary_hits:
+                        break
+                    score += title_hits * TITLE_WEIGHT + summary_hits * SUMMARY_WEIGHT
+                else:
+                    score += _recency_score(entry.get('timestamp', 0), now)
+                    scored.append((score, entry.get('timestamp', 0), entry))
+
+        scored.sort(key=lambda x: (x[0], x[1]), reverse=True)
+        end = offset + limit if limit is not None else None
+        return [entry for _, _, entry in scored[offset:end]]
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _remove(self, doc_id):
+        entry, _, title, summary = self._docs.pop(doc_id)
+        self._by_link.pop(entry.get('link'), None)
+        for gram in bigrams(title) | bigrams(summary):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def _evict(self):
+        # 公開日時が古いものから削除する
+        excess = len(self._docs) - self.max_docs
+        oldest = sorted(self._docs, key=lambda d: self._docs[d][0].get('timestamp', 0))
+        for doc_id in oldest[:excess]:
+            self._remove(doc_id)
+
+
+def _recency_score(timestamp, now):
+    if not timestamp:
+        return 0
+    age_hours = max(0, now - timestamp) / 3600
+    return RECENCY_WEIGHT * math.pow(0.5, age_hours / RECENCY_HALF_LIFE_HOURS)
+
+
+# モジュール共通のインデックス (ウォームなコンテナで使い回す)
+index = SearchIndex()
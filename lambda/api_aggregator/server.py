@@ -0,0 +1,391 @@
+import base64
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# index.handler を Lambda の外で動かすHTTPサーバー (1台のマシンでの運用・ローカルでの負荷試験用)
+#
+#     python lambda/api_aggregator/server.py [--port 8080] [--workers 4] [--snapshots /var/lib/news-hub]
+#
+# - 親プロセスが待ち受けソケットを開き、ワーカープロセスを fork する (pre-fork)
+#   ワーカーは同じソケットから接続を受け付け、HTTP/1.1 の keep-alive でリクエストを処理する
+# - fork する前に親でモジュールを import しておくので、ワーカーの起動が速く、読み込んだコードのメモリも共有される
+# - ワーカーのメモリ上のキャッシュはプロセスごとだが、/tmp の記事ストア・辞書・縮小画像はワーカー間で共有される
+#   --snapshots を指定すると取り込み処理 (ingest.handler) を別プロセスで定期的に実行し、
+#   全ワーカーがそのスナップショットを読む (本番の EventBridge + 取り込み用Lambda と同じ構成)
+# - SIGHUP: コードを読み込み直した新しいワーカーを起動してから、古いワーカーを処理中のリクエストが終わり次第止める
+#   (親プロセスは待ち受けソケットを引き継いだまま自身を exec し直す)
+# - SIGTERM / SIGINT: 処理中のリクエストが終わるのを待って止める
+
+# ワーカーが止まるときに処理中のリクエストを待つ最大時間 (秒)。Lambda のタイムアウトと同じ
+GRACEFUL_TIMEOUT = float(os.environ.get('SERVER_GRACEFUL_TIMEOUT', '30'))
+
+# keep-alive の接続をリクエストがないまま保持する時間 (秒)
+KEEPALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', '15'))
+
+# exec し直すときに引き継ぐ待ち受けソケットと、止める古いワーカー
+LISTEN_FD_ENV = 'NEWS_HUB_LISTEN_FD'
+OLD_WORKERS_ENV = 'NEWS_HUB_OLD_WORKERS'
+
+# fork の前に読み込んでおくモジュール (import だけでスレッドは起動しないもの)
+PRELOAD_MODULES = ('index', 'news', 'weather', 'steam', 'english', 'dictionary', 'articles', 'thumbs',
+                   'feedparser', 'requests')
+
+
+def make_event(method, target, headers, body, client_address):
+    """
+    HTTPリクエストを API Gateway HTTP API (v2) のイベントに変換する
+    同じ名前のクエリパラメータ・ヘッダーは API Gateway と同じくカンマでつなぐ
+    """
+    parts = urlsplit(target)
+    query = {}
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        query[key] = f"{query[key]},{value}" if key in query else value
+
+    event_headers = {}
+    for key, value in headers.items():
+        key = key.lower()
+        event_headers[key] = f"{event_headers[key]},{value}" if key in event_headers else value
+
+    event = {
+        'version': '2.0',
+        'rawPath': parts.path or '/',
+        'rawQueryString': parts.query,
+        'headers': event_headers,
+        'requestContext': {
+            'http': {
+                'method': method,
+                'path': parts.path or '/',
+                'protocol': 'HTTP/1.1',
+                'sourceIp': client_address[0],
+                'userAgent': event_headers.get('user-agent', ''),
+            },
+            'timeEpoch': int(time.time() * 1000),
+        },
+        'isBase64Encoded': False,
+    }
+    if query:
+        event['queryStringParameters'] = query
+    if body:
+        event['body'] = base64.b64encode(body).decode('ascii')
+        event['isBase64Encoded'] = True
+    return event
+
+
+def make_handler(server_state):
+    import index
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # ヘッダーとボディを別々に送るので、Nagle と遅延ACKで待たされないようにする
+        disable_nagle_algorithm = True
+        timeout = KEEPALIVE_TIMEOUT
+
+        def do_GET(self):
+            self._dispatch(send_body=True)
+
+        def do_HEAD(self):
+            self._dispatch(send_body=False)
+
+        def do_OPTIONS(self):
+            self._dispatch(send_body=True)
+
+        def _dispatch(self, send_body):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            event = make_event(self.command, self.path, self.headers, body, self.client_address)
+
+            server_state.begin()
+            try:
+                try:
+                    response = index.handler(event, None)
+                except Exception as e:
+                    print(f"Error handling request: {e}", file=sys.stderr)
+                    response = {'statusCode': 500, 'headers': {'Content-Type': 'application/json'},
+                                'body': '{"error": "Internal Server Error"}'}
+                self._write(response, send_body)
+            finally:
+                server_state.end()
+
+            # 止める準備中のワーカーは、処理し終えた接続から閉じる
+            if server_state.draining:
+                self.close_connection = True
+
+        def _write(self, response, send_body):
+            body = response.get('body') or ''
+            if response.get('isBase64Encoded'):
+                body = base64.b64decode(body)
+            elif isinstance(body, str):
+                body = body.encode('utf-8')
+
+            self.send_response(response.get('statusCode', 200))
+            for key, value in (response.get('headers') or {}).items():
+                self.send_header(key, str(value))
+            for cookie in response.get('cookies') or ():
+                self.send_header('Set-Cookie', cookie)
+            self.send_header('Content-Length', str(len(body)))
+            if server_state.draining:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            if send_body and body:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if server_state.access_log:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+class WorkerState:
+    """
+    ワーカー内で処理中のリクエスト数と、止める準備中かどうか
+    """
+
+    def __init__(self, access_log=False):
+        self.access_log = access_log
+        self.draining = False
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def begin(self):
+        with self._cond:
+            self.active += 1
+
+    def end(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.active == 0, timeout=timeout)
+
+
+class WorkerServer(ThreadingHTTPServer):
+    # 親から受け取った待ち受けソケットを使う (bind・listen しない)
+    daemon_threads = True
+
+    def __init__(self, sock, handler_class):
+        super().__init__(sock.getsockname()[:2], handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+
+    def server_close(self):
+        # 待ち受けソケットは他のワーカーも使っているので、このプロセスの分だけ閉じる
+        self.socket.close()
+
+    def handle_error(self, request, client_address):
+        # クライアントが接続を切ったものは無視する
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def run_worker(sock, args):
+    """
+    ワーカープロセスの本体 (fork された子プロセスで実行する)
+    """
+    state = WorkerState(access_log=args.access_log)
+    server = WorkerServer(sock, make_handler(state))
+
+    def stop(signum, frame):
+        if state.draining:
+            return
+        state.draining = True
+        # serve_forever を実行しているスレッドからは shutdown を呼べないので別スレッドで呼ぶ
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    server.serve_forever()
+    server.server_close()
+    if not state.wait_idle(GRACEFUL_TIMEOUT):
+        print(f"Worker {os.getpid()} exiting with {state.active} requests in flight", file=sys.stderr)
+    return 0
+
+
+def run_ingest(args):
+    """
+    取り込み処理を定期的に実行するプロセスの本体
+    """
+    import ingest
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    while not stopping.is_set():
+        try:
+            ingest.handler({}, None)
+        except Exception as e:
+            print(f"Error running ingestion: {e}", file=sys.stderr)
+        stopping.wait(args.ingest_interval)
+    return 0
+
+
+class Master:
+    """
+    ワーカープロセスを起動・監視する親プロセス
+    """
+
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.workers = {}      # pid -> 種類 ('worker' / 'ingest')
+        self.retiring = set()  # 止めている古いワーカー
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self, kind):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_ingest(self.args) if kind == 'ingest' else run_worker(self.sock, self.args)
+            except BaseException as e:
+                print(f"{kind} {os.getpid()} failed: {e}", file=sys.stderr)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.workers[pid] = kind
+        return pid
+
+    def spawn_all(self):
+        for _ in range(self.args.workers):
+            self.spawn('worker')
+        if self.args.snapshots:
+            self.spawn('ingest')
+
+    def retire(self, pids):
+        for pid in pids:
+            self.retiring.add(pid)
+            self.workers.pop(pid, None)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.retiring.discard(pid)
+
+    def run(self, old_workers=()):
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        self.spawn_all()
+        # 新しいワーカーが受け付け始めてから、exec する前のワーカーを止める
+        self.retire(old_workers)
+        host, port = self.sock.getsockname()[:2]
+        print(f"Serving on http://{host}:{port} with {self.args.workers} workers (pid {os.getpid()})",
+              file=sys.stderr)
+
+        while not self.stopping:
+            if self.reloading:
+                self.reload()
+            self.reap()
+            time.sleep(0.2)
+
+        self.retire(list(self.workers))
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.retiring and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.retiring:
+            os.kill(pid, signal.SIGKILL)
+
+    def reap(self):
+        """
+        終了した子プロセスを回収し、予期せず終了したワーカーは起動し直す
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            kind = self.workers.pop(pid, None)
+            if kind is not None and not self.stopping:
+                print(f"{kind} {pid} exited with status {status}, restarting", file=sys.stderr)
+                time.sleep(0.5)
+                self.spawn(kind)
+
+    def reload(self):
+        """
+        待ち受けソケットと今のワーカーを引き継いで親プロセスを exec し直す
+        (新しい親が読み込み直したコードでワーカーを起動し、引き継いだワーカーを止める)
+        """
+        print("Reloading", file=sys.stderr)
+        self.sock.set_inheritable(True)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in list(self.workers) + list(self.retiring))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def _on_reload(self, signum, frame):
+        self.reloading = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+
+def listen(host, port):
+    inherited = os.environ.pop(LISTEN_FD_ENV, None)
+    if inherited:
+        return socket.socket(fileno=int(inherited))
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+def preload():
+    for name in PRELOAD_MODULES:
+        try:
+            __import__(name)
+        except ImportError as e:
+            print(f"Could not preload {name}: {e}", file=sys.stderr)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='index.handler をHTTPサーバーとして動かす')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--snapshots', help='スナップショットの保存先 (指定すると取り込み処理を定期実行する)')
+    parser.add_argument('--ingest-interval', type=float, default=900, help='取り込み処理の間隔 (秒)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='fork する前にモジュールを読み込まない')
+    parser.add_argument('--access-log', action='store_true')
+    args = parser.parse_args()
+
+    # モジュールの設定は import 時に読まれるので、先に環境変数を設定する
+    # (EMF のメトリクスは CloudWatch Logs 向けなので、明示しない限り出力しない)
+    os.environ.setdefault('METRICS_ENABLED', '0')
+    if args.snapshots:
+        os.environ['SNAPSHOT_STORE'] = args.snapshots
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    old_workers = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+    sock = listen(args.host, args.port)
+    if args.preload:
+        preload()
+    Master(sock, args).run(old_workers)
+
+
+if __name__ == '__main__':
+    main()
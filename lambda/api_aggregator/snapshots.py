@@ -0,0 +1,147 @@
+import json
+import os
+import time
+
+import files
+import metrics
+from cache import TTLCache
+
+# スナップショットの保存先
+#   s3://bucket/prefix  -> S3 (本番)
+#   /path/to/dir        -> ローカルファイルシステム (ローカル実行・検証用)
+#   未設定              -> スナップショットを使わず、リクエスト時に直接取得する
+SNAPSHOT_STORE = os.environ.get('SNAPSHOT_STORE', '')
+
+# 読み取り側で同じスナップショットを何度も取りに行かないためのキャッシュ (秒)
+SNAPSHOT_CACHE_TTL = int(os.environ.get('SNAPSHOT_CACHE_TTL', '60'))
+
+# これより古いスナップショットは使わずに直接取得する (秒)
+# 取り込み処理 (15分ごと) が何回か続けて失敗したら古いデータを返し続けないようにする
+SNAPSHOT_MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE', str(4 * 15 * 60)))
+
+
+class LocalSnapshotStore:
+    """
+    ローカルディレクトリにJSONとして保存するストア
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        files.write_atomic(path, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def get(self, key):
+        path = os.path.join(self.root, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+class S3SnapshotStore:
+    """
+    S3 (またはS3互換ストレージ) に保存するストア
+    エンドポイントは AWS_ENDPOINT_URL_S3 などboto3の標準設定で切り替えられる
+    """
+
+    def __init__(self, bucket, prefix=''):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3')
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, data):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=json.dumps(data, ensure_ascii=False).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+
+class CachedSnapshotStore:
+    """
+    読み取り結果を短時間メモリに保持するラッパー
+    """
+
+    def __init__(self, store, ttl=SNAPSHOT_CACHE_TTL, maxsize=256):
+        self.store = store
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    def put(self, key, data):
+        self.store.put(key, data)
+        self._cache.set(key, data)
+
+    def get(self, key):
+        data, fresh = self._cache.get(key)
+        if fresh:
+            return data
+        data = self.store.get(key)
+        if data is not None:
+            self._cache.set(key, data)
+        return data
+
+
+_store = None
+
+
+def get_store():
+    """
+    設定されたスナップショットストアを返す (未設定ならNone)
+    """
+    global _store
+    if _store is None and SNAPSHOT_STORE:
+        if SNAPSHOT_STORE.startswith('s3://'):
+            bucket, _, prefix = SNAPSHOT_STORE[len('s3://'):].partition('/')
+            store = S3SnapshotStore(bucket, prefix)
+        else:
+            store = LocalSnapshotStore(SNAPSHOT_STORE)
+        _store = CachedSnapshotStore(store)
+    return _store
+
+
+def enabled():
+    return bool(SNAPSHOT_STORE)
+
+
+def wrap(data):
+    """
+    スナップショットとして保存する形式にする (取得時刻を付与)
+    """
+    return {'generated_at': time.time(), 'data': data}
+
+
+def read(key, max_age=SNAPSHOT_MAX_AGE):
+    """
+    スナップショットのデータ部分を返す
+    存在しない場合と、取得時刻から max_age 秒より古い場合はNone (max_age が None なら古くても返す)
+    """
+    store = get_store()
+    if store is None:
+        return None
+    snapshot = store.get(key)
+    if snapshot is None:
+        return None
+    if max_age is not None and time.time() - snapshot.get('generated_at', 0) > max_age:
+        metrics.incr('snapshot_expired')
+        return None
+    return snapshot.get('data')
+
+
+def write(key, data):
+    get_store().put(key, wrap(data))
@@ -1,50 +1,91 @@
-import requests
+import os
 
-def get_steam_info():
+import metrics
+import snapshots
+import upstream
+from cache import TTLCache
+
+SNAPSHOT_KEY = 'steam/featured.json'
+
+STEAM_FEATURED_URL = "https://store.steampowered.com/api/featuredcategories"
+metrics.register_hosts(STEAM_FEATURED_URL)
+
+# featuredcategories の結果を保持する時間 (秒)
+STEAM_CACHE_TTL = int(os.environ.get('STEAM_CACHE_TTL', '600'))
+
+_steam_cache = TTLCache(ttl=STEAM_CACHE_TTL, maxsize=1)
+
+def get_steam_info(use_snapshot=None):
     """
     Steam Store APIから情報を取得する
     セール、新作、人気ゲームを取得
+    /steam/sales, /steam/new, /steam/popular で同じ結果を共有するためキャッシュし、
+    同時に来たリクエストは1回の取得にまとめる
+    取得に失敗した場合は、期限切れでも前回の結果があればそれを返す
+    """
+    _, fresh = _steam_cache.get('featured')
+    metrics.incr('steam_cache_hit' if fresh else 'steam_cache_miss')
+    try:
+        return _steam_cache.get_or_load('featured', lambda: _load(use_snapshot))
+    except Exception as e:
+        print(f"Error fetching Steam info: {e}")
+        stale, _ = _steam_cache.get('featured')
+        if stale is not None:
+            return stale
+        return {"error": str(e)}
+
+def _load(use_snapshot):
+    # スナップショットストアが設定されている場合は取り込み済みのデータを優先する
+    if use_snapshot is None:
+        use_snapshot = snapshots.enabled()
+    if use_snapshot:
+        cached = snapshots.read(SNAPSHOT_KEY)
+        if cached is not None:
+            return cached
+    return fetch_steam_info()
+
+def fetch_steam_info():
+    """
+    Steam Store APIから直接取得する (失敗時は例外を送出)
     """
-    url = "https://store.steampowered.com/api/featuredcategories"
+    url = STEAM_FEATURED_URL
     params = {
         "l": "japanese",
         "cc": "JP"
     }
 
-    try:
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-
-        result = {
-            "sales": [],
-            "new_releases": [],
-            "top_sellers": []
-        }
+    response = upstream.get(url, params=params, timeout=5)
+    response.raise_for_status()
+    data = response.json()
 
-        # 各カテゴリのデータを抽出
-        # specials: セール
-        if 'specials' in data:
-            result['sales'] = extract_games(data['specials'].get('items', []))
+    result = {
+        "sales": [],
+        "new_releases": [],
+        "top_sellers": []
+    }
 
-        # new_releases: 新作
-        if 'new_releases' in data:
-            result['new_releases'] = extract_games(data['new_releases'].get('items', []))
+    # 各カテゴリのデータを抽出
+    # specials: セール
+    if 'specials' in data:
+        result['sales'] = extract_games(data['specials'].get('items', []))
 
-        # top_sellers: 人気
-        if 'top_sellers' in data:
-            result['top_sellers'] = extract_games(data['top_sellers'].get('items', []))
+    # new_releases: 新作
+    if 'new_releases' in data:
+        result['new_releases'] = extract_games(data['new_releases'].get('items', []))
 
-        return result
+    # top_sellers: 人気
+    if 'top_sellers' in data:
+        result['top_sellers'] = extract_games(data['top_sellers'].get('items', []))
 
-    except Exception as e:
-        print(f"Error fetching Steam info: {e}")
-        return {"error": str(e)}
+    return result
 
 def extract_games(items):
     """
     ゲームリストから必要な情報を抽出する
     """
+    # 画像プロキシ (socket・hmac・PIL の確認) は取得した結果を整形するときだけ読み込む
+    import thumbs
+
     games = []
     for item in items:
         # 価格は通常セント単位（または最小通貨単位）
@@ -57,7 +98,8 @@ def extract_games(items):
         games.append({
             "id": item.get('id'),
             "name": item.get('name'),
-            "image": item.get('large_capsule_image'),
+            # カプセル画像は大きいので縮小プロキシ (/thumb) 経由にする
+            "image": thumbs.proxy_url(item.get('large_capsule_image')),
             "price": price / 100 if price else 0,
             "original_price": original_price / 100 if original_price else 0,
             "discount": item.get('discount_percent', 0),
@@ -0,0 +1,417 @@
+import hashlib
+import hmac
+import io
+import ipaddress
+import os
+import socket
+import threading
+from urllib.parse import urlencode, urljoin, urlsplit
+
+import files
+import metrics
+import upstream
+
+# ニュース・Steam の画像を縮小して返すプロキシ (/api/thumb)
+# 記事の画像は本文用の大きな画像のことが多く、小さなカードに表示するには重すぎるので、
+# 決まった幅に縮小・再エンコードしたものを /tmp に保存して返す
+#
+# 保存先は内容のハッシュで決める (content-addressed)
+#   refs/<URLのハッシュ>           : 元画像のハッシュ (URLが違っても同じ画像は1つにまとまる)
+#   blobs/<元画像のハッシュ>-<幅>.<拡張子> : 縮小した画像
+# 合計サイズが THUMB_CACHE_MAX_BYTES を超えたら、最後に使われたのが古いものから削除する
+#
+# 任意のURLを取得する踏み台にならないよう、プロキシのURLには署名を付ける
+# (THUMB_SIGNING_KEY が未設定の場合は画像のURLを書き換えず、/thumb も使えない)
+# 署名するのはフィードに載っていたURLなので、取得する前にホストのアドレスを確認し、
+# ループバック・プライベート・リンクローカルなど内部のアドレスには接続しない (リダイレクト先も同じ)
+
+# Pillow はオプション (Lambdaのパッケージに含めた場合だけ縮小する。ない場合は元の画像にリダイレクトする)
+# 読み込みが重いので、縮小するときに import する
+
+THUMB_SIGNING_KEY = os.environ.get('THUMB_SIGNING_KEY', '')
+
+# プロキシのURL (CloudFront から /api/* で API Gateway に届く)
+THUMB_BASE_URL = os.environ.get('THUMB_BASE_URL', '/api/thumb')
+
+# 縮小する幅 (これ以外の幅は受け付けない)
+THUMB_WIDTHS = (160, 320, 640)
+
+# 画像のURLを書き換えるときの幅 (カードの表示サイズの2倍程度)
+THUMB_DEFAULT_WIDTH = int(os.environ.get('THUMB_DEFAULT_WIDTH', '320'))
+
+# 出力形式と品質 (WEBP に対応していない Pillow では JPEG にする)
+THUMB_FORMAT = os.environ.get('THUMB_FORMAT', 'WEBP').upper()
+THUMB_QUALITY = int(os.environ.get('THUMB_QUALITY', '75'))
+
+THUMB_CACHE_DIR = os.environ.get('THUMB_CACHE_DIR', '/tmp/thumbs')
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('THUMB_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+
+# 取得する元画像の最大サイズ (バイト)
+THUMB_MAX_SOURCE_BYTES = int(os.environ.get('THUMB_MAX_SOURCE_BYTES', str(8 * 1024 * 1024)))
+
+# 縮小する元画像の最大画素数
+# PNG などは小さなファイルでも展開すると巨大になる (256MB の Lambda では RGBA で 20M 画素が 80MB)
+THUMB_MAX_PIXELS = int(os.environ.get('THUMB_MAX_PIXELS', str(20 * 1000 * 1000)))
+
+# ブラウザ・CloudFront にキャッシュさせる時間 (秒)
+# 同じURLと幅からは同じ画像ができるので長くてよい
+THUMB_MAX_AGE = int(os.environ.get('THUMB_MAX_AGE', str(7 * 24 * 3600)))
+
+THUMB_TIMEOUT = 5  # 秒
+
+# 元画像を取得するときにたどるリダイレクトの最大回数
+THUMB_MAX_REDIRECTS = 3
+
+# 元画像を読み込む単位 (バイト)
+THUMB_READ_CHUNK = 64 * 1024
+
+# refs/ のファイル1つがディスクで使う大きさの目安 (ブロック1つ分)
+REF_SIZE = 4096
+
+CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+# 同じ画像を同時に縮小しないためのロック (URLごと)
+_locks = {}
+_locks_lock = threading.Lock()
+
+# 前回の削除から書き込んだバイト数 (毎回ディレクトリを走査しないため)
+_written = 0
+_written_lock = threading.Lock()
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+class ForbiddenHost(Exception):
+    """
+    内部のアドレスに向いたURLなので取得しない
+    """
+
+
+class ImageTooLarge(Exception):
+    """
+    元画像の画素数が THUMB_MAX_PIXELS を超えている
+    """
+
+
+class UnsupportedImage(Exception):
+    """
+    元画像を画像として読めない
+    """
+
+
+class Redirect(Exception):
+    """
+    縮小できないので元の画像を直接取得してもらう
+    """
+
+    def __init__(self, url):
+        super().__init__(url)
+        self.url = url
+
+
+def enabled():
+    return bool(THUMB_SIGNING_KEY)
+
+
+def sign(url, width):
+    message = f"{width}:{url}".encode('utf-8')
+    return hmac.new(THUMB_SIGNING_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def proxy_url(url, width=None):
+    """
+    画像のURLをプロキシのURLに書き換える
+    (署名鍵が未設定・http(s) 以外・書き換え済みのURLはそのまま返す)
+    """
+    if not url or not enabled() or url.startswith(THUMB_BASE_URL):
+        return url
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not _may_be_public(parts.hostname):
+        return url
+    width = width or THUMB_DEFAULT_WIDTH
+    return f"{THUMB_BASE_URL}?{urlencode({'url': url, 'w': width, 's': sign(url, width)})}"
+
+
+def rewrite_images(items, width=None):
+    """
+    記事・ゲームの一覧の image をプロキシのURLに書き換える (取り込み時に使う)
+    """
+    if not enabled():
+        return items
+    for item in items:
+        if item.get('image'):
+            item['image'] = proxy_url(item['image'], width)
+    return items
+
+
+def get_thumbnail(url, width, signature):
+    """
+    縮小した画像を (バイト列, Content-Type, ハッシュ) で返す
+    署名が合わない場合は InvalidSignature、幅が不正な場合は ValueError、
+    Pillow がない場合は Redirect、内部のアドレスに向いたURLの場合は ForbiddenHost、
+    元画像が読めない場合は UnsupportedImage、大きすぎる場合は ImageTooLarge を送出する
+    """
+    if not enabled():
+        raise InvalidSignature('Thumbnails are disabled')
+    if not url:
+        raise ValueError('url is required')
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        raise ValueError(f"w must be one of {', '.join(map(str, THUMB_WIDTHS))}")
+    if width not in THUMB_WIDTHS:
+        raise ValueError(f"w must be one of {', '.join(map(str, THUMB_WIDTHS))}")
+    if not signature or not hmac.compare_digest(signature, sign(url, width)):
+        raise InvalidSignature('Invalid signature')
+
+    image_module = _image_module()
+    if image_module is None:
+        raise Redirect(url)
+
+    ref_path = _ref_path(url)
+    with _lock_for(url):
+        source_digest = _read_text(ref_path)
+        if source_digest:
+            cached = _read_blob(source_digest, width)
+            if cached is not None:
+                os.utime(ref_path)
+                metrics.incr('thumb_hit')
+                return cached
+
+        metrics.incr('thumb_miss')
+        source = _fetch(url)
+        source_digest = hashlib.sha256(source).hexdigest()
+        _write_file(ref_path, source_digest.encode('ascii'))
+        _evict_if_needed(REF_SIZE)
+        # 別のURLで同じ画像を縮小済みならそれを使う
+        cached = _read_blob(source_digest, width)
+        if cached is not None:
+            return cached
+
+        with metrics.timer('resize'):
+            data, image_format = _resize(image_module, source, width)
+        path = _blob_path(source_digest, width, image_format)
+        _write_file(path, data)
+        _evict_if_needed(len(data))
+        return data, CONTENT_TYPES[image_format], _output_digest(path)
+
+
+def _image_module():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def _fetch(url):
+    # リダイレクト先も内部のアドレスでないか確かめるため、リダイレクトは自分でたどる
+    for _ in range(THUMB_MAX_REDIRECTS + 1):
+        _check_host(url)
+        response = upstream.get(url, timeout=THUMB_TIMEOUT, stream=True, allow_redirects=False)
+        try:
+            if response.is_redirect:
+                url = urljoin(url, response.headers['Location'])
+                continue
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if content_type and not content_type.startswith('image/'):
+                raise RuntimeError(f"Not an image: {content_type}")
+            return _read_limited(response)
+        finally:
+            response.close()
+    raise RuntimeError(f"Too many redirects: {url}")
+
+
+def _read_limited(response):
+    """
+    本文を THUMB_MAX_SOURCE_BYTES まで読む (超えたらその時点でやめる)
+    """
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > THUMB_MAX_SOURCE_BYTES:
+        raise RuntimeError(f"Image too large: {length} bytes")
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(THUMB_READ_CHUNK):
+        size += len(chunk)
+        if size > THUMB_MAX_SOURCE_BYTES:
+            raise RuntimeError(f"Image too large: more than {THUMB_MAX_SOURCE_BYTES} bytes")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _check_host(url):
+    """
+    url のホストが公開されたアドレスだけに解決されるか確かめる (そうでなければ ForbiddenHost)
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ForbiddenHost(f"Unsupported URL: {url}")
+    if upstream.REWRITE_BASE:
+        # ローカルでの検証用にすべての取得をスタブに向けている (接続先はスタブのアドレスになる)
+        return
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)}
+    except socket.gaierror as e:
+        raise RuntimeError(f"Cannot resolve {parts.hostname}: {e}")
+    for address in addresses:
+        if not _is_public(ipaddress.ip_address(address.split('%')[0])):
+            raise ForbiddenHost(f"Host is not allowed: {parts.hostname}")
+
+
+def _is_public(address):
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def _may_be_public(host):
+    """
+    名前を解決せずに分かる範囲で、公開されたホストか (IPアドレスと localhost だけを見る)
+    """
+    if not host:
+        return False
+    if host == 'localhost' or host.endswith('.localhost'):
+        return False
+    try:
+        return _is_public(ipaddress.ip_address(host))
+    except ValueError:
+        return True
+
+
+def _resize(Image, source, width):
+    """
+    幅 width に縮小して (バイト列, 形式) を返す (元の幅より大きくはしない)
+    """
+    try:
+        image = Image.open(io.BytesIO(source))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Image.UnidentifiedImageError:
+        raise UnsupportedImage('Unsupported image format')
+    # open はヘッダーを読むだけなので、展開する前に画素数を確かめる (展開すると画素数に比例してメモリを使う)
+    if image.width * image.height > THUMB_MAX_PIXELS:
+        raise ImageTooLarge(f"Image too large: {image.width}x{image.height} pixels")
+    # JPEG は読み込み時に縮小できるので、必要な大きさより少し大きい程度でデコードする
+    image.draft('RGB', (width * 2, width * 2))
+
+    image_format = THUMB_FORMAT
+    if image_format == 'WEBP' and not _supports_webp(Image):
+        image_format = 'JPEG'
+    # パレット画像などは縮小の前に変換する (そのままでは補間できない)
+    if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image_format != 'JPEG' and _has_alpha(image) else 'RGB')
+
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=THUMB_QUALITY, optimize=True)
+    return output.getvalue(), image_format
+
+
+def _supports_webp(Image):
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _lock_for(url):
+    with _locks_lock:
+        lock = _locks.get(url)
+        if lock is None:
+            if len(_locks) > 1024:
+                _locks.clear()
+            lock = _locks[url] = threading.Lock()
+        return lock
+
+
+def _ref_path(url):
+    return os.path.join(THUMB_CACHE_DIR, 'refs', hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+
+def _blob_path(source_digest, width, image_format):
+    return os.path.join(THUMB_CACHE_DIR, 'blobs', f"{source_digest}-{width}.{image_format.lower()}")
+
+
+def _read_blob(source_digest, width):
+    for image_format, content_type in CONTENT_TYPES.items():
+        path = _blob_path(source_digest, width, image_format)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        # 最後に使った時刻を更新する (削除の順番に使う)
+        os.utime(path)
+        return data, content_type, _output_digest(path)
+    return None
+
+
+def _output_digest(path):
+    # ファイル名が元画像のハッシュと幅なので、ETag にはそれを使う
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    files.write_atomic(path, data)
+
+
+def _evict_if_needed(size):
+    """
+    書き込んだ量が上限の1割を超えるごとに合計サイズを確認し、
+    上限を超えていれば最後に使われたのが古いものから削除する
+    (縮小画像と refs/ をまとめて数える。refs/ は小さいが、URLごとに1つできるのでディスクのブロック単位で数える)
+    """
+    global _written
+    with _written_lock:
+        _written += size
+        if _written < THUMB_CACHE_MAX_BYTES // 10:
+            return
+        _written = 0
+
+    cached_files = []
+    total = 0
+    for name in ('refs', 'blobs'):
+        try:
+            entries = list(os.scandir(os.path.join(THUMB_CACHE_DIR, name)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                file_size = max(stat.st_size, stat.st_blocks * 512)
+                cached_files.append((stat.st_mtime, file_size, entry.path))
+                total += file_size
+    if total <= THUMB_CACHE_MAX_BYTES:
+        return
+
+    removed = 0
+    # 上限の8割まで減らす (すぐにまた削除しないように)
+    for _, file_size, path in sorted(cached_files):
+        if total <= THUMB_CACHE_MAX_BYTES * 0.8:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= file_size
+        removed += 1
+    metrics.incr('thumb_evicted', removed)
+    print(f"Evicted {removed} thumbnail files ({total} bytes left)")
@@ -0,0 +1,312 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import metrics
+
+# 外部APIへのアクセスをまとめるモジュール
+# ウォームなLambdaコンテナではセッション (keep-alive接続) とスレッドを使い回し、
+# 毎回のTCP/TLSハンドシェイクやスレッド生成を避ける
+
+DEFAULT_TIMEOUT = 5  # 秒
+
+# 同じホストへの同時接続数の上限
+HOST_CONCURRENCY = int(os.environ.get('UPSTREAM_HOST_CONCURRENCY', '4'))
+
+# 並列取得に使うスレッド数
+MAX_WORKERS = int(os.environ.get('UPSTREAM_MAX_WORKERS', '16'))
+
+USER_AGENT = 'news-hub/1.0'
+
+# 上流のURLの書き換え先 (ベンチマーク・ローカル検証でスタブサーバーに向ける)
+# 例: http://127.0.0.1:8080 を指定すると https://host/path は http://127.0.0.1:8080/host/path になる
+REWRITE_BASE = os.environ.get('UPSTREAM_REWRITE_BASE', '').rstrip('/')
+
+# ホストごとに保持する直近のリクエスト数 (応答時間・エラー率の集計対象)
+STATS_WINDOW = int(os.environ.get('UPSTREAM_STATS_WINDOW', '50'))
+
+# サーキットブレーカー
+# 直近 BREAKER_MIN_REQUESTS 件以上のうちエラーが BREAKER_ERROR_RATE 以上になったら
+# BREAKER_COOLDOWN 秒間そのホストへのリクエストを止め、その後1件だけ試して戻すか判断する
+BREAKER_MIN_REQUESTS = int(os.environ.get('UPSTREAM_BREAKER_MIN_REQUESTS', '5'))
+BREAKER_ERROR_RATE = float(os.environ.get('UPSTREAM_BREAKER_ERROR_RATE', '0.5'))
+BREAKER_COOLDOWN = float(os.environ.get('UPSTREAM_BREAKER_COOLDOWN', '30'))
+
+# 適応タイムアウト: 成功したリクエストの応答時間のパーセンタイル x 倍率
+# (呼び出し側が指定したタイムアウトより長くはしない)
+ADAPTIVE_TIMEOUT_PERCENTILE = float(os.environ.get('UPSTREAM_TIMEOUT_PERCENTILE', '95'))
+ADAPTIVE_TIMEOUT_FACTOR = float(os.environ.get('UPSTREAM_TIMEOUT_FACTOR', '3'))
+ADAPTIVE_TIMEOUT_MIN = float(os.environ.get('UPSTREAM_TIMEOUT_MIN', '1'))
+
+# requests は読み込みが重いので、最初に外部APIへアクセスするときに作る
+_session = None
+_session_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+_host_limits = {}
+_host_healths = {}
+_host_limits_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """
+    締め切りまでに終わらなかった (name は処理の名前またはURL)
+    """
+
+    def __init__(self, name):
+        super().__init__(f"{name} timed out")
+        self.name = name
+
+
+class CircuitOpen(Exception):
+    """
+    ホストのサーキットブレーカーが開いていてリクエストしなかった
+    """
+    pass
+
+
+class HostHealth:
+    """
+    ホストごとの直近の応答時間・エラーと、サーキットブレーカーの状態
+    closed (通常) -> open (停止中) -> half_open (1件だけ試す) -> closed / open
+    """
+
+    def __init__(self):
+        self.samples = deque(maxlen=STATS_WINDOW)  # (応答時間 秒, 成功したか)
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        リクエストしてよいか確認する (だめなら CircuitOpen を送出)
+        """
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                    raise CircuitOpen()
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self.probing:
+                    raise CircuitOpen()
+                self.probing = True
+
+    def cancel(self):
+        """
+        acquire したがリクエストしなかった (結果を記録しない)
+        """
+        with self._lock:
+            self.probing = False
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.probing = False
+            if self.state == 'half_open':
+                if ok:
+                    # 回復したので、止める前の記録は捨てて集計し直す
+                    self.state = 'closed'
+                    self.samples.clear()
+                else:
+                    self._open()
+            self.samples.append((latency, ok))
+            if self.state == 'closed' and self._failing():
+                self._open()
+
+    def timeout(self, requested):
+        """
+        直近の応答時間から決めたタイムアウト (requested を上限とする)
+        """
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self.samples if ok)
+        if len(latencies) < BREAKER_MIN_REQUESTS:
+            return requested
+        adaptive = _percentile(latencies, ADAPTIVE_TIMEOUT_PERCENTILE) * ADAPTIVE_TIMEOUT_FACTOR
+        return min(requested, max(ADAPTIVE_TIMEOUT_MIN, adaptive))
+
+    def stats(self):
+        with self._lock:
+            samples = list(self.samples)
+            state = self.state
+        latencies = sorted(latency for latency, ok in samples if ok)
+        errors = sum(1 for _, ok in samples if not ok)
+        return {
+            'state': state,
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 3) if samples else 0.0,
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+            'p95_ms': round(_percentile(latencies, 95) * 1000, 1) if latencies else None,
+            'timeout_sec': round(self.timeout(DEFAULT_TIMEOUT), 3)
+        }
+
+    def _failing(self):
+        if len(self.samples) < BREAKER_MIN_REQUESTS:
+            return False
+        errors = sum(1 for _, ok in self.samples if not ok)
+        return errors / len(self.samples) >= BREAKER_ERROR_RATE
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+
+
+def deadline_after(seconds):
+    """
+    今から seconds 秒後の締め切り (time.monotonic基準)
+    """
+    return time.monotonic() + seconds
+
+
+def remaining(deadline):
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def get(url, params=None, headers=None, timeout=DEFAULT_TIMEOUT, deadline=None, stream=False,
+        allow_redirects=True):
+    """
+    共有セッションでGETする
+    タイムアウトはホストの直近の応答時間に合わせて縮め、
+    deadline が指定されている場合はさらに締め切りまでの残り時間に縮める
+    ホストのサーキットブレーカーが開いている場合は CircuitOpen を送出する
+    stream=True の場合は本文を読まずに返す (呼び出し側で読んでから close する)
+    """
+    host = urlsplit(url).hostname
+    health = _host_health(host)
+    health.acquire()
+
+    timeout = health.timeout(timeout)
+    limited_by_deadline = False
+    left = remaining(deadline)
+    if left is not None:
+        if left <= 0:
+            health.cancel()
+            raise DeadlineExceeded(url)
+        if left < timeout:
+            timeout = left
+            limited_by_deadline = True
+
+    limit = _host_limit(host)
+    if not limit.acquire(timeout=timeout):
+        health.cancel()
+        raise DeadlineExceeded(url)
+    started = time.monotonic()
+    try:
+        response = _get_session().get(_rewrite(url), params=params, headers=headers, timeout=timeout,
+                                      stream=stream, allow_redirects=allow_redirects)
+    except Exception as e:
+        import requests
+
+        if limited_by_deadline and isinstance(e, requests.Timeout):
+            # 呼び出し側の締め切りで打ち切っただけなので、ホストの失敗には数えない
+            health.cancel()
+        else:
+            health.record(time.monotonic() - started, False)
+        raise
+    else:
+        elapsed = time.monotonic() - started
+        health.record(elapsed, response.status_code < 500)
+        if stream:
+            length = response.headers.get('Content-Length', '')
+            size = int(length) if length.isdigit() else 0
+        else:
+            size = len(response.content)
+        metrics.add_upstream(host, elapsed * 1000, size)
+        return response
+    finally:
+        limit.release()
+
+
+def get_host_stats():
+    """
+    ホストごとの直近の応答時間・エラー率・ブレーカーの状態
+    """
+    with _host_limits_lock:
+        hosts = dict(_host_healths)
+    return {host: health.stats() for host, health in sorted(hosts.items())}
+
+
+def run_all(calls, deadline=None, executor=None):
+    """
+    {名前: 引数なしの関数} を並列に実行して {名前: 結果} を返す
+    deadline は全体で1つの締め切り、または {名前: 締め切り} で処理ごとに指定する
+    例外になったもの・締め切りまでに終わらなかったものは結果に例外オブジェクトが入る
+    (締め切りに間に合わなかった処理も裏では最後まで実行される)
+    """
+    executor = executor or _executor
+    # リクエストの集計 (metrics) を引き継ぐため、呼び出し元のコンテキストで実行する
+    futures = {name: executor.submit(contextvars.copy_context().run, fn) for name, fn in calls.items()}
+    if isinstance(deadline, dict):
+        deadlines = deadline
+    else:
+        deadlines = dict.fromkeys(calls, deadline)
+
+    # 締め切りの早いものから順に待つ
+    for name in sorted(futures, key=lambda name: deadlines.get(name) or float('inf')):
+        wait([futures[name]], timeout=remaining(deadlines.get(name)))
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = DeadlineExceeded(name)
+        elif future.exception() is not None:
+            results[name] = future.exception()
+        else:
+            results[name] = future.result()
+    return results
+
+
+def _get_session():
+    global _session
+    if _session is not None:
+        return _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=HOST_CONCURRENCY)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+def _host_limit(host):
+    with _host_limits_lock:
+        limit = _host_limits.get(host)
+        if limit is None:
+            limit = _host_limits[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return limit
+
+
+def _rewrite(url):
+    if not REWRITE_BASE:
+        return url
+    parts = urlsplit(url)
+    rewritten = f"{REWRITE_BASE}/{parts.netloc}{parts.path or '/'}"
+    return f"{rewritten}?{parts.query}" if parts.query else rewritten
+
+
+def _host_health(host):
+    with _host_limits_lock:
+        health = _host_healths.get(host)
+        if health is None:
+            health = _host_healths[host] = HostHealth()
+        return health
+
+
+def _percentile(sorted_values, percent):
+    # 最近傍法 (件数が少ないので補間はしない)
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
@@ -1,11 +1,72 @@
-import requests
-from datetime import datetime
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import json
+import math
+import os
+import threading
+import time
 
-def get_weather(lat=None, lon=None):
+import metrics
+import snapshots
+import upstream
+from cache import TTLCache
+from prefectures import PREFECTURES
+
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+AIR_QUALITY_URL = "https://air-quality-api.open-meteo.com/v1/air-quality"
+metrics.register_hosts(WEATHER_URL, AIR_QUALITY_URL)
+
+# 天気予報と花粉情報をまとめて待つ時間 (秒)
+# 花粉情報が間に合わなかった場合は pollen_error を付けて天気だけ返す
+WEATHER_DEADLINE = float(os.environ.get('WEATHER_DEADLINE', '5'))
+
+# キャッシュの格子の細かさ (度)。0.1度は約10km
+WEATHER_GRID_DEG = float(os.environ.get('WEATHER_GRID_DEG', '0.1'))
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get('WEATHER_CACHE_MAX_ENTRIES', '256'))
+# 正時の更新が上流に反映されるまでの余裕 (秒)
+WEATHER_CACHE_MARGIN = 120
+# 花粉情報が欠けたデータを保持する時間 (秒)
+WEATHER_PARTIAL_TTL = 60
+# 事前読み込み時のOpen-Meteoへの同時リクエスト数
+WARM_UP_CONCURRENCY = 4
+
+_weather_cache = TTLCache(ttl=3600, maxsize=WEATHER_CACHE_MAX_ENTRIES)
+
+JST = timezone(timedelta(hours=9))
+
+# hourly で返す時間数の既定値と上限
+DEFAULT_HOURS = 24
+MAX_HOURS = 168
+
+POLLEN_TYPES = [
+    "alder_pollen", "birch_pollen", "grass_pollen", "mugwort_pollen",
+    "olive_pollen", "ragweed_pollen"
+]
+
+def grid_point(lat, lon):
+    """
+    座標をキャッシュ用の格子点に丸める
+    近い地点のリクエストは同じ格子点の予報を共有する
+    """
+    step = WEATHER_GRID_DEG
+    return round(round(lat / step) * step, 4), round(round(lon / step) * step, 4)
+
+def snapshot_key(lat, lon):
+    """
+    座標に対応するスナップショットのキー (格子点単位)
+    """
+    lat, lon = grid_point(lat, lon)
+    return f"weather/{lat:.4f},{lon:.4f}.json"
+
+def get_weather(lat=None, lon=None, use_snapshot=None, hours=None, format=None):
     """
     Open-Meteo APIから天気情報を取得する
     デフォルトは東京 (35.6895, 139.6917)
+    格子点ごとにキャッシュし、スナップショットストアが設定されている場合は
+    取り込み済みのデータを優先する
+    hours: 現在時刻から何時間分の hourly を返すか (既定24)
+    format: "columnar" の場合 daily/hourly をキーごとの配列で返す
     """
     if lat is None:
         lat = 35.6895
@@ -18,9 +79,77 @@ def get_weather(lat=None, lon=None):
         lon = float(lon)
     except ValueError:
         return {"error": "Invalid latitude or longitude"}
+    # inf や nan、範囲外の値は格子点に丸められないので、ここで弾く
+    if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+        return {"error": "Invalid latitude or longitude"}
+
+    try:
+        hours = min(max(int(hours or DEFAULT_HOURS), 1), MAX_HOURS)
+    except ValueError:
+        return {"error": "Invalid hours"}
 
+    grid_lat, grid_lon = grid_point(lat, lon)
+    try:
+        raw, source = get_raw(grid_lat, grid_lon, use_snapshot=use_snapshot)
+    except Exception as e:
+        print(f"Error fetching weather: {e}")
+        return {"error": str(e) or type(e).__name__}
+
+    metrics.incr(f"weather_cache_{source}")
+    with metrics.timer("parse"):
+        result = _build_forecast(raw["forecast"], hours=hours, columnar=(format == "columnar"))
+        if raw.get("air_quality") is not None:
+            result["pollen"] = _build_pollen(raw["air_quality"])
+        else:
+            result["pollen_error"] = raw.get("pollen_error")
+
+    # どちらの上流が遅いかを確認できるように所要時間を返す (締め切りに間に合わなかったものはNone)
+    result["meta"] = {
+        "timings_ms": raw.get("timings_ms", {}),
+        "cache": source,
+        "grid": [grid_lat, grid_lon]
+    }
+    return result
+
+def get_raw(lat, lon, use_snapshot=None):
+    """
+    格子点の上流レスポンスを (データ, 取得元) で返す
+    取得元は hit (メモリキャッシュ) / snapshot / miss (上流から取得) /
+    stale (上流から取得できず、期限切れのキャッシュを返した)
+    天気予報が取得できず、キャッシュもない場合は例外を送出する
+    """
+    key = (lat, lon)
+    cached, fresh = _weather_cache.get(key)
+    if fresh:
+        return cached, "hit"
+
+    if use_snapshot is None:
+        use_snapshot = snapshots.enabled()
+    if use_snapshot:
+        raw = snapshots.read(snapshot_key(lat, lon))
+        if raw is not None:
+            _weather_cache.set(key, raw, ttl=_cache_ttl())
+            return raw, "snapshot"
+        # 取り込み対象外の地点は直接取得する
+
+    try:
+        raw = fetch_raw(lat, lon)
+    except Exception as e:
+        # 上流が落ちている (サーキットブレーカーが開いている) 間は最後に取得できたデータを返す
+        if cached is None:
+            raise
+        print(f"Error fetching weather, serving stale data: {e}")
+        return cached, "stale"
+    # 花粉情報が取れなかった場合は、次のリクエストで取り直せるよう短めに保持する
+    ttl = _cache_ttl() if raw.get("air_quality") is not None else WEATHER_PARTIAL_TTL
+    _weather_cache.set(key, raw, ttl=ttl)
+    return raw, "miss"
+
+def fetch_raw(lat, lon):
+    """
+    天気予報と花粉情報を上流から取得する
+    """
     # 1. 天気予報 (Weather Forecast)
-    weather_url = "https://api.open-meteo.com/v1/forecast"
     weather_params = {
         "latitude": lat,
         "longitude": lon,
@@ -30,100 +159,161 @@ def get_weather(lat=None, lon=None):
         "timezone": "Asia/Tokyo"
     }
 
-    result = {}
-
-    try:
-        response = requests.get(weather_url, params=weather_params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-
-        result["current"] = data.get("current_weather", {})
-
-        # Daily processing
-        result["daily"] = []
-        daily = data.get("daily", {})
-        if daily:
-            times = daily.get("time", [])
-            max_temps = daily.get("temperature_2m_max", [])
-            min_temps = daily.get("temperature_2m_min", [])
-            precip_probs = daily.get("precipitation_probability_max", [])
-            weather_codes = daily.get("weathercode", [])
-
-            for i in range(len(times)):
-                result["daily"].append({
-                    "date": times[i],
-                    "max_temp": max_temps[i] if i < len(max_temps) else None,
-                    "min_temp": min_temps[i] if i < len(min_temps) else None,
-                    "precip_prob": precip_probs[i] if i < len(precip_probs) else None,
-                    "weather_code": weather_codes[i] if i < len(weather_codes) else None
-                })
-
-        # Hourly processing (Next 24 hours)
-        result["hourly"] = []
-        hourly = data.get("hourly", {})
-        if hourly:
-            times = hourly.get("time", [])
-            temps = hourly.get("temperature_2m", [])
-            probs = hourly.get("precipitation_probability", [])
-            amounts = hourly.get("precipitation", [])
-
-            # Simple slice: first 24 hours provided by API (starts from 00:00 today usually)
-            # Or we could try to find current hour. Open-Meteo returns history + forecast.
-            # We'll just take the first 24 entries which represent "Today" usually,
-            # or if we want "from now", we'd need to parse time.
-            # Let's return the first 24 hours of data returned (which is usually today 00:00 to 23:00)
-            count = min(len(times), 24)
-            for i in range(count):
-                result["hourly"].append({
-                    "time": times[i],
-                    "temp": temps[i] if i < len(temps) else None,
-                    "precip_prob": probs[i] if i < len(probs) else None,
-                    "precip_amount": amounts[i] if i < len(amounts) else None
-                })
-
-    except Exception as e:
-        print(f"Error fetching weather: {e}")
-        return {"error": str(e)}
-
     # 2. 花粉情報 (Pollen / Air Quality)
     # Open-Meteo Air Quality API
     # Note: Pollen data is primarily for Europe in Open-Meteo. Japan specific pollen (Cedar/Cypress) might not be available or requires specific endpoint.
     # We will use standard types. If data is not available for Japan, it may return nulls or 0.
-    pollen_url = "https://air-quality-api.open-meteo.com/v1/air-quality"
     pollen_params = {
         "latitude": lat,
         "longitude": lon,
-        "hourly": "alder_pollen,birch_pollen,grass_pollen,mugwort_pollen,olive_pollen,ragweed_pollen",
+        "hourly": ",".join(POLLEN_TYPES),
         "timezone": "Asia/Tokyo"
     }
 
-    try:
-        p_response = requests.get(pollen_url, params=pollen_params, timeout=5)
-        p_response.raise_for_status()
-        p_data = p_response.json()
-
-        result["pollen"] = {}
-
-        hourly_pollen = p_data.get("hourly", {})
-        if hourly_pollen:
-            # Calculate max for today (first 24 hours) for each type
-            pollen_types = [
-                "alder_pollen", "birch_pollen", "grass_pollen", "mugwort_pollen",
-                "olive_pollen", "ragweed_pollen"
-            ]
-
-            for p_type in pollen_types:
-                values = hourly_pollen.get(p_type, [])
-                # Take max of first 24 hours
-                today_values = values[:24] if values else []
-                # Filter out None values
-                valid_values = [v for v in today_values if v is not None]
-                max_val = max(valid_values) if valid_values else 0
-                result["pollen"][p_type] = max_val
+    # 2つのAPIを同時に呼び出し、1つの締め切りで待つ
+    deadline = upstream.deadline_after(WEATHER_DEADLINE)
+    timings = {}
+    responses = upstream.run_all({
+        "forecast": lambda: _fetch_json(WEATHER_URL, weather_params, deadline, timings, "forecast"),
+        "air_quality": lambda: _fetch_json(AIR_QUALITY_URL, pollen_params, deadline, timings, "air_quality")
+    }, deadline=deadline)
 
-    except Exception as e:
-        print(f"Error fetching pollen: {e}")
-        result["pollen_error"] = str(e)
+    data = responses["forecast"]
+    if isinstance(data, Exception):
+        raise data
+
+    raw = {
+        "forecast": data,
+        "air_quality": None,
+        "timings_ms": {name: timings.get(name) for name in responses}
+    }
+
+    p_data = responses["air_quality"]
+    if isinstance(p_data, Exception):
         # Non-critical, continue
+        print(f"Error fetching pollen: {p_data}")
+        raw["pollen_error"] = str(p_data) or type(p_data).__name__
+    else:
+        raw["air_quality"] = p_data
+    return raw
+
+def warm_up(locations=None):
+    """
+    都道府県庁所在地 (または指定地点) の天気をキャッシュに読み込んでおく
+    """
+    if locations is None:
+        locations = [(p["lat"], p["lon"]) for p in PREFECTURES]
+    points = sorted({grid_point(lat, lon) for lat, lon in locations})
+
+    def load(point):
+        try:
+            get_raw(*point)
+            return True
+        except Exception as e:
+            print(f"Error warming up weather {point}: {e}")
+            return False
+
+    # get_raw の中で upstream のスレッドプールを使うため、別のスレッドで回す
+    with ThreadPoolExecutor(max_workers=WARM_UP_CONCURRENCY) as executor:
+        results = list(executor.map(load, points))
+    return {"locations": len(points), "failed": results.count(False)}
+
+def seconds_until_update():
+    # Open-Meteoは1時間ごとに更新されるので、次の正時までの秒数
+    return 3600 - time.time() % 3600
+
+def _cache_ttl():
+    # 次の正時 (+余裕) まで保持する
+    return seconds_until_update() + WEATHER_CACHE_MARGIN
+
+def _fetch_json(url, params, deadline, timings, name):
+    started = time.perf_counter()
+    try:
+        response = upstream.get(url, params=params, timeout=WEATHER_DEADLINE, deadline=deadline)
+        response.raise_for_status()
+        return response.json()
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+# Open-Meteoの列名 -> レスポンスのキー
+DAILY_COLUMNS = [
+    ("time", "date"),
+    ("temperature_2m_max", "max_temp"),
+    ("temperature_2m_min", "min_temp"),
+    ("precipitation_probability_max", "precip_prob"),
+    ("weathercode", "weather_code")
+]
+HOURLY_COLUMNS = [
+    ("time", "time"),
+    ("temperature_2m", "temp"),
+    ("precipitation_probability", "precip_prob"),
+    ("precipitation", "precip_amount")
+]
+
+def _build_forecast(data, hours=DEFAULT_HOURS, now=None, columnar=False):
+    """
+    天気予報のレスポンスを整形する
+    hourly は現在時刻の時間帯から hours 時間分を返す
+    columnar=True の場合は行に展開せず、キーごとの配列のまま返す
+    """
+    result = {}
+    result["current"] = data.get("current_weather", {})
+
+    daily = data.get("daily") or {}
+    times = daily.get("time", [])
+    columns = _slice_columns(daily, DAILY_COLUMNS, 0, len(times))
+    if columnar:
+        result["daily"] = columns
+    else:
+        result["daily"] = [
+            {"date": d, "max_temp": hi, "min_temp": lo, "precip_prob": p, "weather_code": c}
+            for d, hi, lo, p, c in zip(*columns.values())
+        ]
+
+    hourly = data.get("hourly") or {}
+    times = hourly.get("time", [])
+    # 時刻は "YYYY-MM-DDTHH:MM" (Asia/Tokyo) で昇順なので、文字列のまま二分探索できる
+    now = now or datetime.now(JST)
+    start = bisect_left(times, now.strftime('%Y-%m-%dT%H:00'))
+    if start >= len(times):
+        start = max(len(times) - hours, 0)
+    columns = _slice_columns(hourly, HOURLY_COLUMNS, start, min(start + hours, len(times)))
+    if columnar:
+        result["hourly"] = columns
+    else:
+        result["hourly"] = [
+            {"time": t, "temp": temp, "precip_prob": p, "precip_amount": a}
+            for t, temp, p, a in zip(*columns.values())
+        ]
 
     return result
+
+def _slice_columns(block, columns, start, end):
+    """
+    列ごとの配列から [start, end) の範囲をまとめて切り出す
+    配列が短い場合は None で埋める
+    """
+    sliced = {}
+    for source, key in columns:
+        column = (block.get(source) or [])[start:end]
+        if len(column) < end - start:
+            column = column + [None] * (end - start - len(column))
+        sliced[key] = column
+    return sliced
+
+def _build_pollen(p_data):
+    """
+    花粉の種類ごとに今日 (先頭24時間) の最大値を返す
+    """
+    hourly_pollen = p_data.get("hourly") or {}
+    if not hourly_pollen:
+        return {}
+    pollen = {}
+    for p_type in POLLEN_TYPES:
+        valid_values = [v for v in (hourly_pollen.get(p_type) or [])[:24] if v is not None]
+        pollen[p_type] = max(valid_values) if valid_values else 0
+    return pollen
+
+# WEATHER_WARM_UP=1 の場合はコールドスタート時に裏で主要地点を読み込む
+if os.environ.get('WEATHER_WARM_UP') == '1':
+    threading.Thread(target=warm_up, daemon=True).start()
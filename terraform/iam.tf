@@ -44,3 +44,30 @@ resource "aws_iam_role_policy" "lambda_logs" {
     ]
   })
 }
+
+# -----------------------------------------------------------------------------
+# スナップショット用S3バケットの読み書き権限
+# -----------------------------------------------------------------------------
+resource "aws_iam_role_policy" "lambda_snapshots" {
+  name = "${var.project_name}-${var.environment}-lambda-snapshots"
+  role = aws_iam_role.lambda.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ]
+        Resource = "${aws_s3_bucket.snapshots.arn}/*"
+      },
+      {
+        Effect   = "Allow"
+        Action   = "s3:ListBucket"
+        Resource = aws_s3_bucket.snapshots.arn
+      }
+    ]
+  })
+}
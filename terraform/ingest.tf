@@ -0,0 +1,68 @@
+# =============================================================================
+# 取り込み処理（ニュース・Steam・天気のスナップショット作成）
+# =============================================================================
+
+# -----------------------------------------------------------------------------
+# スナップショット保存用S3バケット
+# -----------------------------------------------------------------------------
+resource "aws_s3_bucket" "snapshots" {
+  bucket = "${var.project_name}-${var.environment}-snapshots-${random_id.bucket_suffix.hex}"
+}
+
+resource "aws_s3_bucket_public_access_block" "snapshots" {
+  bucket = aws_s3_bucket.snapshots.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+# -----------------------------------------------------------------------------
+# 取り込み用Lambda関数（APIと同じパッケージ、ハンドラーのみ異なる）
+# -----------------------------------------------------------------------------
+resource "aws_lambda_function" "ingest" {
+  function_name = "${var.project_name}-${var.environment}-ingest"
+  role          = aws_iam_role.lambda.arn
+  handler       = "ingest.handler"
+  runtime       = "python3.12"
+  memory_size   = 256
+  timeout       = 120
+
+  filename         = data.archive_file.api_package.output_path
+  source_code_hash = data.archive_file.api_package.output_base64sha256
+
+  environment {
+    variables = {
+      ENVIRONMENT       = var.environment
+      SNAPSHOT_STORE    = "s3://${aws_s3_bucket.snapshots.id}/snapshots"
+      THUMB_SIGNING_KEY = random_id.thumb_signing_key.hex
+    }
+  }
+}
+
+resource "aws_cloudwatch_log_group" "ingest" {
+  name              = "/aws/lambda/${aws_lambda_function.ingest.function_name}"
+  retention_in_days = 14
+}
+
+# -----------------------------------------------------------------------------
+# 定期実行スケジュール（EventBridge）
+# -----------------------------------------------------------------------------
+resource "aws_cloudwatch_event_rule" "ingest" {
+  name                = "${var.project_name}-${var.environment}-ingest"
+  schedule_expression = var.ingest_schedule
+}
+
+resource "aws_cloudwatch_event_target" "ingest" {
+  rule = aws_cloudwatch_event_rule.ingest.name
+  arn  = aws_lambda_function.ingest.arn
+}
+
+resource "aws_lambda_permission" "ingest_schedule" {
+  statement_id  = "AllowEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.ingest.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.ingest.arn
+}
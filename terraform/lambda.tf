@@ -12,6 +12,14 @@ data "archive_file" "api_package" {
   excludes    = ["__pycache__", "*.pyc"]
 }
 
+# -----------------------------------------------------------------------------
+# 画像の縮小プロキシ (/api/thumb) のURLの署名鍵
+# 取り込み用Lambdaが署名し、API用Lambdaが検証するので同じ値を渡す
+# -----------------------------------------------------------------------------
+resource "random_id" "thumb_signing_key" {
+  byte_length = 32
+}
+
 # -----------------------------------------------------------------------------
 # Lambda関数
 # -----------------------------------------------------------------------------
@@ -28,9 +36,11 @@ resource "aws_lambda_function" "api" {
 
   environment {
     variables = {
-      ENVIRONMENT     = var.environment
-      STEAM_API_KEY   = var.steam_api_key
-      WORDNIK_API_KEY = var.wordnik_api_key
+      ENVIRONMENT       = var.environment
+      STEAM_API_KEY     = var.steam_api_key
+      WORDNIK_API_KEY   = var.wordnik_api_key
+      SNAPSHOT_STORE    = "s3://${aws_s3_bucket.snapshots.id}/snapshots"
+      THUMB_SIGNING_KEY = random_id.thumb_signing_key.hex
     }
   }
 }
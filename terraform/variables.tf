@@ -41,3 +41,13 @@ variable "wordnik_api_key" {
   sensitive   = true
   default     = ""
 }
+
+# -----------------------------------------------------------------------------
+# 取り込み処理
+# -----------------------------------------------------------------------------
+
+variable "ingest_schedule" {
+  description = "取り込み用Lambdaの実行スケジュール（EventBridge式）"
+  type        = string
+  default     = "rate(15 minutes)"
+}
@@ -0,0 +1,73 @@
+"""
+dedup.cluster のテスト
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+import dedup  # noqa: E402
+
+
+def entry(title, link, source):
+    return {'title': title, 'link': link, 'source': source, 'timestamp': 0}
+
+
+def test_exact_duplicate_link_is_merged():
+    entries = [
+        entry('任天堂、新型ゲーム機を正式に発表', 'https://www.example.jp/news/1?utm_source=rss', 'A'),
+        entry('新型ゲーム機を発表 (任天堂)', 'https://example.jp/news/1/', 'B'),
+    ]
+    result = dedup.cluster(entries)
+    assert [e['link'] for e in result] == ['https://www.example.jp/news/1?utm_source=rss']
+    assert result[0]['alternates'] == [
+        {'source': 'B', 'link': 'https://example.jp/news/1/', 'title': '新型ゲーム機を発表 (任天堂)'}
+    ]
+
+
+def test_cross_source_near_duplicate_is_merged():
+    title = '「ゼルダの伝説」新作が2026年春に発売決定、Switch 2向けに新要素も'
+    entries = [
+        entry(title, 'https://a.example.jp/1', 'A'),
+        entry(f"{title} - ファミ通.com", 'https://b.example.jp/2', 'B'),
+    ]
+    result = dedup.cluster(entries)
+    assert len(result) == 1
+    assert [a['link'] for a in result[0]['alternates']] == ['https://b.example.jp/2']
+    # キャッシュ中の記事は書き換えない
+    assert 'alternates' not in entries[0]
+
+
+def test_same_source_near_duplicate_is_kept():
+    title = '「ゼルダの伝説」新作が2026年春に発売決定、Switch 2向けに新要素も'
+    entries = [
+        entry(title, 'https://a.example.jp/1', 'A'),
+        entry(f"{title} - ファミ通.com", 'https://b.example.jp/2', 'B'),
+        entry(f"【続報】{title}", 'https://a.example.jp/3', 'A'),
+    ]
+    result = dedup.cluster(entries)
+    assert [e['link'] for e in result] == ['https://a.example.jp/1', 'https://a.example.jp/3']
+    assert [a['link'] for a in result[0]['alternates']] == ['https://b.example.jp/2']
+
+
+def test_distinct_short_titles_are_not_merged():
+    # SimHashでは4〜5しか離れない、主語や述語だけ違う定型の見出し
+    pairs = [
+        ('政府、新サービスを決定', '楽天、新サービスを延期'),
+        ('グーグル、新型機を延期', 'グーグル、新料金を延期'),
+    ]
+    for a, b in pairs:
+        result = dedup.cluster([entry(a, 'https://a.example.jp/1', 'A'), entry(b, 'https://b.example.jp/2', 'B')])
+        assert [e['title'] for e in result] == [a, b]
+        assert all('alternates' not in e for e in result)
+
+
+def test_cluster_key_reuses_result_for_same_entries():
+    entries = [entry('政府、新サービスを決定', f"https://a.example.jp/{i}", 'A') for i in range(3)]
+    first = dedup.cluster(entries, key='test')
+    assert dedup.cluster(list(entries), key='test') == first
+    changed = entries[:2]
+    assert len(dedup.cluster(changed, key='test')) == 2
@@ -0,0 +1,47 @@
+"""
+feedparser 経由 (news._parse_entries) と fastfeed のパース結果が同じになるかのテスト
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, '..', 'lambda', 'api_aggregator'))
+
+feedparser = pytest.importorskip('feedparser')
+
+import fastfeed  # noqa: E402
+import news  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, '..', 'benchmarks', 'fixtures', 'feeds')
+
+
+@pytest.fixture
+def tokyo_time():
+    # 地方時が UTC でないマシン (server.py を TZ=Asia/Tokyo で動かす場合など) でも同じ結果になること
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Tokyo'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+@pytest.mark.parametrize('name', sorted(os.listdir(FIXTURES)))
+def test_parsers_agree(name, tokyo_time):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        data = f.read()
+
+    expected = news._parse_entries(feedparser.parse(data))
+    _, entries = fastfeed.parse(data)
+    for entry in entries:
+        entry['summary'] = news.clean_summary(entry['summary'])
+
+    assert entries == expected